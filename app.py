@@ -2,11 +2,15 @@
 # Focus: plant health, quality, hydraulics & maintenance (NO electrical inputs)
 # English + Arabic UI, rich outputs, per-vessel rejection, weekly/monthly, exports (in Part 2)
 
-import os, io, re, json, smtplib, base64, hashlib, hmac
+import os, io, re, sys, json, time, mmap, tempfile, smtplib, base64, hashlib, hmac, operator, logging
 from email.mime.text import MIMEText
 from email.utils import formatdate
 from pathlib import Path
-from datetime import datetime, date, timedelta
+from types import MappingProxyType, SimpleNamespace
+from functools import lru_cache
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import date, timedelta
 
 import numpy as np
 import pandas as pd
@@ -19,15 +23,19 @@ except Exception:
     class SignatureExpired(Exception): ...
     class BadSignature(Exception): ...
     class _MiniSerializer:
-        def _init_(self, secret): self.secret = secret.encode()
+        def __init__(self, secret):
+            self._base = hmac.new(secret.encode(), b"", hashlib.sha256)  # keyed once, copied per use
+        def _sign(self, msg):
+            h = self._base.copy(); h.update(msg); return h.digest()
         def dumps(self, text, salt=""):
             msg = (salt + "|" + text).encode()
-            sig = hmac.new(self.secret, msg, hashlib.sha256).digest()
-            return base64.urlsafe_b64encode(msg + b"." + sig).decode()
+            return base64.urlsafe_b64encode(msg + self._sign(msg)).decode()
         def loads(self, token, salt="", max_age=None):
-            raw = base64.urlsafe_b64decode(token.encode())
-            msg, sig = raw.rsplit(b".", 1)
-            if not hmac.compare_digest(hmac.new(self.secret, msg, hashlib.sha256).digest(), sig):
+            try: raw = base64.urlsafe_b64decode(token.encode())
+            except Exception: raise BadSignature("bad token")
+            msg, sig = raw[:-32], raw[-32:]  # SHA-256 tag is fixed-size
+            # authenticate before touching the payload
+            if len(raw) <= 32 or not hmac.compare_digest(self._sign(msg), sig):
                 raise BadSignature("bad sig")
             _salt, text = msg.decode().split("|", 1)
             if _salt != salt: raise BadSignature("bad salt")
@@ -39,6 +47,32 @@ try:
 except Exception:
     bcrypt = None; BCRYPT_OK = False
 
+try:
+    from argon2 import PasswordHasher
+    _argon2 = PasswordHasher(); ARGON2_OK = True
+except Exception:
+    _argon2 = None; ARGON2_OK = False
+
+SCRYPT_OK = hasattr(hashlib, "scrypt")  # needs OpenSSL 1.1+
+
+try:
+    import orjson; ORJSON_OK = True
+except Exception:
+    orjson = None; ORJSON_OK = False
+
+def _json_default(o):
+    if isinstance(o, set): return sorted(o)
+    if isinstance(o, deque): return list(o)
+    raise TypeError(f"not JSON serializable: {type(o).__name__}")
+def _json_dumps_bytes(obj) -> bytes:
+    if ORJSON_OK: return orjson.dumps(obj, default=_json_default, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, default=_json_default).encode()
+def _json_loads(b: bytes):
+    return orjson.loads(b) if ORJSON_OK else json.loads(b)
+def _json_line(obj) -> bytes:
+    if ORJSON_OK: return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY) + b"\n"
+    return json.dumps(obj).encode() + b"\n"
+
 # exports (used in Part 2)
 try:
     from reportlab.lib.pagesizes import A4
@@ -54,6 +88,27 @@ try:
     XLSX_OK = True
 except Exception:
     XLSX_OK = False
+# workbook options for every export: cell text goes in as-is, no per-string number/formula/URL sniffing;
+# in_memory assembles the zip parts in RAM instead of a temp file per part before the final deflate
+XLSX_ENGINE_KWARGS = {"options": {"strings_to_numbers": False, "strings_to_formulas": False, "strings_to_urls": False,
+                                  "in_memory": True}}
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PARQUET_OK = True
+except Exception:
+    PARQUET_OK = False
+
+try:
+    from numba import njit, prange
+    NUMBA_OK = True
+except Exception:
+    NUMBA_OK = False
+    def njit(*args, **kw):
+        if args and callable(args[0]): return args[0]
+        return lambda f: f
+    prange = range
 
 # -------------------- app meta & theme --------------------
 BRAND = "LeeWave"
@@ -67,21 +122,27 @@ REPORTS_DIRNAME = "reports"
 for d in [DATA_DIR, USERS_DIR]: d.mkdir(parents=True, exist_ok=True)
 
 st.set_page_config(page_title=f"{BRAND} — RO Dashboard", page_icon="💧", layout="wide")
-st.markdown(
-    f"""
-    <style>
-      .block-container{{padding-top:0.7rem}}
-      h1,h2,h3,h4{{color:{PRIMARY_HEX}}}
-      .lee-badge{{background:{ACCENT_HEX};border:1px solid #b8f2f7;padding:6px 10px;border-radius:10px;display:inline-block}}
-      .good{{background:#eaf8ef;border-radius:8px;padding:6px 10px}}
-      .warn{{background:#fff8e1;border-radius:8px;padding:6px 10px}}
-      .bad{{background:#fdecea;border-radius:8px;padding:6px 10px}}
-      .kcard div[data-testid="stMetricValue"]{{font-size:22px}}
-      .tight-table td, .tight-table th {{ padding: 6px 8px !important; }}
-    </style>
-    """,
-    unsafe_allow_html=True
-)
+
+@st.cache_resource(show_spinner=False)
+def _theme_css() -> str:
+    # built once per process; still emitted every run because Streamlit drops elements a rerun doesn't re-send,
+    # so it is minified here to keep the per-rerun payload small
+    return "".join(ln.strip() for ln in (
+        f"""
+        <style>
+          .block-container{{padding-top:0.7rem}}
+          h1,h2,h3,h4{{color:{PRIMARY_HEX}}}
+          .lee-badge{{background:{ACCENT_HEX};border:1px solid #b8f2f7;padding:6px 10px;border-radius:10px;display:inline-block}}
+          .good{{background:#eaf8ef;border-radius:8px;padding:6px 10px}}
+          .warn{{background:#fff8e1;border-radius:8px;padding:6px 10px}}
+          .bad{{background:#fdecea;border-radius:8px;padding:6px 10px}}
+          .kcard div[data-testid="stMetricValue"]{{font-size:22px}}
+          .tight-table td, .tight-table th {{ padding: 6px 8px !important; }}
+        </style>
+        """
+    ).splitlines())
+
+st.markdown(_theme_css(), unsafe_allow_html=True)
 
 # -------------------- env (reset links) --------------------
 SECRET_KEY   = os.environ.get("SECRET_KEY", "dev-change-me-please")
@@ -99,22 +160,64 @@ def _hash_bcrypt(pw: str) -> str:
 def _verify_bcrypt(pw: str, hashed: str) -> bool:
     try: return bcrypt.checkpw(pw.encode(), hashed.encode())
     except Exception: return False
+PBKDF2_ITERS = 100_000
+def _pbkdf2_sha256(pw_bytes: bytes, salt: bytes) -> bytes:
+    # hashlib's C PBKDF2 keys the HMAC once and copies the ipad/opad states every round
+    return hashlib.pbkdf2_hmac("sha256", pw_bytes, salt, PBKDF2_ITERS)
 def _hash_pbkdf2(pw: str) -> str:
     salt = os.urandom(16)
-    dk = hashlib.pbkdf2_hmac("sha256", pw.encode(), salt, 100_000)
+    dk = _pbkdf2_sha256(pw.encode(), salt)
     return "pbkdf2$" + base64.b64encode(salt + dk).decode()
 def _verify_pbkdf2(pw: str, hashed: str) -> bool:
+    # no early exit: malformed hashes still pay the full derivation + compare
+    salt, dk, valid = b"\x00"*16, b"\x00"*32, False
     try:
-        b = base64.b64decode(hashed.split("pbkdf2$")[1].encode())
-        salt, dk = b[:16], b[16:]
-        dk2 = hashlib.pbkdf2_hmac("sha256", pw.encode(), salt, 100_000)
-        return hmac.compare_digest(dk, dk2)
+        b = base64.b64decode(hashed.split("pbkdf2$", 1)[1].encode())
+        if len(b) == 48: salt, dk, valid = b[:16], b[16:], True
+    except Exception: pass
+    dk2 = _pbkdf2_sha256(pw.encode(), salt)
+    return hmac.compare_digest(dk, dk2) and valid
+def _hash_argon2(pw: str) -> str:
+    return _argon2.hash(pw)  # self-describing "$argon2id$..." string
+def _verify_argon2(pw: str, hashed: str) -> bool:
+    try: return _argon2.verify(hashed, pw)
     except Exception: return False
+SCRYPT_N, SCRYPT_R, SCRYPT_P = 2**14, 8, 1
+def _hash_scrypt(pw: str) -> str:
+    salt = os.urandom(16)
+    dk = hashlib.scrypt(pw.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=32)
+    return "scrypt$" + base64.b64encode(salt + dk).decode()
+def _verify_scrypt(pw: str, hashed: str) -> bool:
+    # same shape as _verify_pbkdf2: a malformed hash still pays the full derivation
+    salt, dk, valid = b"\x00"*16, b"\x00"*32, False
+    try:
+        b = base64.b64decode(hashed.split("scrypt$", 1)[1].encode())
+        if len(b) == 48: salt, dk, valid = b[:16], b[16:], True
+    except Exception: pass
+    dk2 = hashlib.scrypt(pw.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=32)
+    return hmac.compare_digest(dk, dk2) and valid
 def hash_password(pw: str) -> str:
-    return _hash_bcrypt(pw) if BCRYPT_OK else _hash_pbkdf2(pw)
+    # strongest available: argon2 > bcrypt > scrypt > pbkdf2
+    if ARGON2_OK: return _hash_argon2(pw)
+    if BCRYPT_OK: return _hash_bcrypt(pw)
+    if SCRYPT_OK: return _hash_scrypt(pw)
+    return _hash_pbkdf2(pw)
+# scheme tag -> verifier; "pbkdf2$…"/"scrypt$…" carry it up front, "$argon2…"/"$2b$…" right after the first "$"
+_VERIFIERS = {"pbkdf2": _verify_pbkdf2, "scrypt": _verify_scrypt if SCRYPT_OK else None,
+              "argon2": _verify_argon2 if ARGON2_OK else None, "bcrypt": _verify_bcrypt if BCRYPT_OK else None}
+def _scheme(hashed: str) -> str:
+    head, _sep, rest = hashed.partition("$")
+    return head or ("argon2" if rest.startswith("argon2") else "bcrypt" if rest[:1] == "2" else "")
+@st.cache_resource(show_spinner=False)
+def _decoy_hash() -> str:
+    # a real hash in the default scheme: an unknown user costs exactly what a freshly registered one does
+    return hash_password(base64.b64encode(os.urandom(18)).decode())
 def verify_password(pw: str, hashed: str) -> bool:
-    if hashed.startswith("pbkdf2$"): return _verify_pbkdf2(pw, hashed)
-    return _verify_bcrypt(pw, hashed) if BCRYPT_OK else False
+    verify = _VERIFIERS.get(_scheme(hashed))
+    if verify is not None: return verify(pw, hashed)
+    # unknown/unsupported scheme (or no user): run the default scheme's check against the decoy, then fail
+    _VERIFIERS[_scheme(_decoy_hash())](pw, _decoy_hash())
+    return False
 
 # -------------------- users db --------------------
 USERS_DB_PATH = DATA_DIR / "users.json"
@@ -131,21 +234,53 @@ def _default_users():
         "requests": []
     }
 
-def save_users(obj: dict): USERS_DB_PATH.write_text(json.dumps(obj, indent=2))
+@st.cache_data(max_entries=4, show_spinner=False)
+def _load_users_cached(mtime_ns: int, size: int) -> dict:
+    # keyed on the file version (ns mtime + size): parsed once per change, every caller gets its own copy
+    return _json_loads(USERS_DB_PATH.read_bytes())
+def _users_version() -> tuple:
+    stt = USERS_DB_PATH.stat(); return stt.st_mtime_ns, stt.st_size
+
+MAX_REQUESTS = 1000
+
+def _upgrade_users(db: dict) -> dict:
+    # in memory: set for O(1) capacity membership, bounded deque for requests (lists again on disk)
+    for u in db.get("users", {}).values():
+        u["capacities_used"] = set(u.get("capacities_used", []))
+    db["requests"] = deque(db.get("requests", []), maxlen=MAX_REQUESTS)
+    return db
+
+def save_users(obj: dict):
+    # write-then-rename: a concurrent load never sees a half-written file (and falls back to defaults)
+    tmp = USERS_DB_PATH.with_suffix(".json.tmp"); tmp.write_bytes(_json_dumps_bytes(obj)); os.replace(tmp, USERS_DB_PATH)
+    _load_users_cached.clear()
 def load_users() -> dict:
     if not USERS_DB_PATH.exists(): save_users(_default_users())
-    try: return json.loads(USERS_DB_PATH.read_text())
+    try: return _upgrade_users(_load_users_cached(*_users_version()))
     except Exception:
-        save_users(_default_users()); return json.loads(USERS_DB_PATH.read_text())
+        save_users(_default_users()); return _upgrade_users(_load_users_cached(*_users_version()))
+
+EMAIL_RE = re.compile(r"^[^@]+@[^@]+\.[^@]+$")
+DIGIT_RE = re.compile(r"\d")
+SAFE_RE  = re.compile(r"[^a-zA-Z0-9_.-]+")
 
 def normalize_email(e: str) -> str: return (e or "").strip().lower()
-def email_safe(e: str) -> str: return re.sub(r"[^a-zA-Z0-9_.-]+", "_", normalize_email(e))
+def email_safe(e: str) -> str: return SAFE_RE.sub("_", normalize_email(e))
+def email_fp(e: str) -> str:
+    # fixed-width, non-secret fingerprint: directory names and cache keys carry no raw email
+    return hashlib.blake2b(normalize_email(e).encode(), digest_size=8).hexdigest()
 
 def user_dir(email: str) -> Path:
-    d = USERS_DIR / email_safe(email)
+    # directories are created once per session, not on every rerun
+    key = f"_udir_{email}"; cached = st.session_state.get(key)
+    if cached: return Path(cached)
+    d = USERS_DIR / email_fp(email)
+    legacy = USERS_DIR / email_safe(email)
+    if not d.exists() and legacy.is_dir(): legacy.rename(d)  # lazy migration of old per-email dirs
     d.mkdir(parents=True, exist_ok=True)
     for sub in ["daily","weekly","monthly"]:
         (d / REPORTS_DIRNAME / sub).mkdir(parents=True, exist_ok=True)
+    st.session_state[key] = str(d)
     return d
 
 def set_user_status(email: str, status: str):
@@ -153,26 +288,78 @@ def set_user_status(email: str, status: str):
     if not u: return False
     u["status"]=status; save_users(db); return True
 
+# one pooled SMTP connection per process; a single worker serializes access to it
+@st.cache_resource(show_spinner=False)
+def _mail_state():
+    # cached so the connection and pool survive reruns (module globals are rebuilt on each one)
+    return {"conn": None, "pool": ThreadPoolExecutor(max_workers=1, thread_name_prefix="mail")}
+
+def _get_smtp(state: dict):
+    if state["conn"] is not None:
+        try:
+            if state["conn"].noop()[0] == 250: return state["conn"]
+        except smtplib.SMTPException: pass
+    state["conn"] = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
+    state["conn"].starttls(); state["conn"].login(SMTP_USER, SMTP_PASS)
+    return state["conn"]
+
+log = logging.getLogger(__name__)
+MAIL_WAIT_S = 8  # how long the reset form waits for SMTP before reporting on the next rerun instead
+
+def _send_mail(state: dict, to_email: str, raw: str):
+    try:
+        try: _get_smtp(state).sendmail(MAIL_FROM, [to_email], raw)
+        except smtplib.SMTPServerDisconnected:
+            state["conn"] = None; _get_smtp(state).sendmail(MAIL_FROM, [to_email], raw)
+    except Exception as e:
+        log.warning("reset email delivery failed: %s", type(e).__name__)  # no address in the log
+        raise
+
 def send_reset_email(to_email: str, reset_link: str) -> bool:
     if not (SMTP_HOST and SMTP_USER and SMTP_PASS and MAIL_FROM):
         st.info(f"🔗 Reset link (SMTP not configured): {reset_link}"); return True
     msg = MIMEText(f"Reset your {BRAND} password:\n{reset_link}\n(Link valid ~30 min)", "plain", "utf-8")
     msg["Subject"] = f"{BRAND} — Reset your password"; msg["From"]=MAIL_FROM; msg["To"]=to_email
     msg["Date"] = formatdate(localtime=True)
+    state = _mail_state()
+    job = state["pool"].submit(_send_mail, state, to_email, msg.as_string())
     try:
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as s:
-            s.starttls(); s.login(SMTP_USER, SMTP_PASS); s.sendmail(MAIL_FROM, [to_email], msg.as_string())
-        return True
+        job.result(timeout=MAIL_WAIT_S); return True  # wait briefly so a failure still reaches the user
+    except FutureTimeout:
+        st.session_state["reset_mail_job"] = job  # reported by login_view once it finishes
+        st.info("Still sending the reset email… the result will show here shortly."); return False
     except Exception as e:
         st.error(f"Email send failed: {e}"); return False
 
 # -------------------- session & auth --------------------
 if "authed" not in st.session_state:
     st.session_state.authed=False; st.session_state.user_email=None; st.session_state.user_role=None
-if "login_attempts" not in st.session_state: st.session_state.login_attempts=0
-if "lock_until" not in st.session_state: st.session_state.lock_until=None
+# failed logins go to a shared append-only log, so a lockout holds across tabs/sessions.
+# Only the last _ATTEMPTS_TAIL bytes (~1000 entries) are scanned, so a flood of failures for
+# other emails within LOCK_WINDOW_S can push an email's older failures out of view.
+ATTEMPTS_PATH = DATA_DIR / "attempts.jsonl"
+LOCK_WINDOW_S, LOCK_MAX_ATTEMPTS = 120, 5
+_ATTEMPTS_TAIL = 64*1024
+_ATTEMPT_RE = re.compile(rb'\{"e":\s*"([^"]*)",\s*"t":\s*([0-9.eE+-]+)\}')
+
+def record_failed_login(e: str):
+    with open(ATTEMPTS_PATH, "ab") as f: f.write(_json_line({"e": e, "t": time.time()}))
+    if ATTEMPTS_PATH.stat().st_size > 16*_ATTEMPTS_TAIL:  # compact: only the tail is ever read
+        tail = ATTEMPTS_PATH.read_bytes()[-_ATTEMPTS_TAIL:]
+        tmp = ATTEMPTS_PATH.with_suffix(f".{os.getpid()}.tmp"); tmp.write_bytes(tail[tail.find(b"\n")+1:]); os.replace(tmp, ATTEMPTS_PATH)
+    _recent_failures.clear()
+
+@st.cache_data(ttl=5, show_spinner=False)
+def _recent_failures(e: str) -> int:
+    try:
+        with open(ATTEMPTS_PATH, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0: return 0  # mmap rejects an empty file
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm: buf = mm[max(0, len(mm)-_ATTEMPTS_TAIL):]
+    except FileNotFoundError: return 0
+    cutoff = time.time() - LOCK_WINDOW_S; key = e.encode()
+    return sum(1 for m in _ATTEMPT_RE.finditer(buf) if m.group(1)==key and float(m.group(2))>=cutoff)
 
-def is_locked(): lu=st.session_state.lock_until; return (lu is not None) and (datetime.now()<lu)
+def is_locked(e: str) -> bool: return _recent_failures(e) >= LOCK_MAX_ATTEMPTS
 
 def register_view():
     st.title("Create your account")
@@ -182,8 +369,8 @@ def register_view():
         ok = st.form_submit_button("Register")
     if ok:
         e = normalize_email(email)
-        if not re.match(r"^[^@]+@[^@]+\.[^@]+$", e): st.error("Invalid email."); return
-        if len(pw)<8 or not re.search(r"\d", pw): st.error("Password must be ≥ 8 characters and include a number."); return
+        if not EMAIL_RE.match(e): st.error("Invalid email."); return
+        if len(pw)<8 or not DIGIT_RE.search(pw): st.error("Password must be ≥ 8 characters and include a number."); return
         if pw!=pw2: st.error("Passwords do not match."); return
         db=load_users()
         if e in db["users"]: st.error("Email already registered."); return
@@ -202,7 +389,7 @@ def reset_password_view(token: str):
         pw = st.text_input("New Password", type="password"); pw2 = st.text_input("Confirm New Password", type="password")
         ok = st.form_submit_button("Update Password")
     if ok:
-        if len(pw)<8 or not re.search(r"\d", pw): st.error("Password must be ≥ 8 characters and include a number."); return
+        if len(pw)<8 or not DIGIT_RE.search(pw): st.error("Password must be ≥ 8 characters and include a number."); return
         if pw!=pw2: st.error("Passwords do not match."); return
         db=load_users(); u=db["users"].get(normalize_email(email))
         if not u: st.error("User not found."); return
@@ -211,9 +398,13 @@ def reset_password_view(token: str):
 
 def login_view():
     st.title("LeeWave RO • Sign in")
+    job = st.session_state.get("reset_mail_job")
+    if job is not None and job.done():
+        del st.session_state["reset_mail_job"]
+        if job.exception() is None: st.success("Reset link sent.")
+        else: st.error(f"Email send failed: {job.exception()}")
     qp = st.query_params
     if "reset_token" in qp: reset_password_view(qp["reset_token"]); st.stop()
-    if is_locked(): st.error("Too many attempts. Try again later."); st.stop()
     with st.form("login"):
         email_in = st.text_input("Email", placeholder="you@company.com")
         pwd_in   = st.text_input("Password", type="password", placeholder="••••••••")
@@ -235,109 +426,95 @@ def login_view():
         st.stop()
     if ok:
         e = normalize_email(email_in); db=load_users(); u=db["users"].get(e)
-        if not u or not verify_password(pwd_in, u.get("password_hash","")):
-            st.error("Invalid email or password."); st.session_state.login_attempts += 1
+        if is_locked(e): st.error("Too many attempts. Try again later."); st.stop()
+        pw_ok = verify_password(pwd_in, (u or {}).get("password_hash",""))  # always runs, even for unknown emails
+        if not u or not pw_ok:
+            st.error("Invalid email or password."); record_failed_login(e)
         elif u.get("status")!="active":
             st.error("Account not active.")
         else:
             st.session_state.authed=True; st.session_state.user_email=e; st.session_state.user_role=u.get("role","user")
-            st.session_state.login_attempts=0; user_dir(e); st.rerun()
-        if st.session_state.login_attempts>=5:
-            st.session_state.lock_until = datetime.now()+timedelta(minutes=2)
+            user_dir(e)  # the caller clears the form and renders the app in this same run
+        if is_locked(e):
             st.warning("Too many attempts. Locked for 2 minutes.")
 
+def _logout():
+    # on_click runs before the next script pass, so that pass already renders the sign-in page
+    st.session_state.authed=False; st.session_state.user_email=None; st.session_state.user_role=None
+
 def logout_button():
     with st.sidebar:
         st.markdown("---")
         st.caption(f"Signed in as: *{st.session_state.user_email}* ({st.session_state.user_role})")
-        if st.button("Logout"):
-            st.session_state.authed=False; st.session_state.user_email=None; st.session_state.user_role=None; st.rerun()
+        st.button("Logout", on_click=_logout)
 
 if not st.session_state.get("authed", False):
-    login_view(); st.stop()
-else:
-    logout_button()
+    login_slot = st.empty()
+    with login_slot.container(): login_view()
+    if not st.session_state.get("authed", False): st.stop()
+    login_slot.empty()  # signed in during this run: drop the form and carry on, no second pass
+logout_button()
 
 # -------------------- language pack (English + Arabic) --------------------
-T = {
-    "English": {
-        "Language":"Language","Select Language":"Select Language","Plant Setup":"Plant Setup","Number of Stages":"Number of Stages",
-        "Vessels / Membranes":"Vessels / Membranes","Vessels":"Vessels",'Membranes per vessel (8")':'Membranes per vessel (8")',
-        "Plant Capacity":"Plant Capacity","Design Recovery %":"Design Recovery %",
-        "Dashboard":"Dashboard","Daily Report":"Daily Report","Weekly Report":"Weekly Report","Monthly Report":"Monthly Report",
-        "History & Exports":"History & Exports","RO Design":"RO Design","RO Design — Quick Sizing":"RO Design — Quick Sizing",
-        "Daily Inputs":"Daily Inputs","Date":"Date","Operator (optional)":"Operator (optional)","Operator Notes":"Operator Notes",
-        "Feed TDS (ppm)":"Feed TDS (ppm)","Product TDS (ppm)":"Product TDS (ppm)",
-        "Feed Pressure IN (bar)":"Feed Pressure IN (bar)","Feed Pressure OUT (bar)":"Feed Pressure OUT (bar)",
-        "Cartridge Filter Pressure (bar)":"Cartridge Filter Pressure (bar)",
-        "HP Pump IN (bar)":"HP Pump IN (bar)","HP Pump OUT (bar)":"HP Pump OUT (bar)",
-        "Feed Flow (LPM)":"Feed Flow (LPM)","Product Flow (LPM)":"Product Flow (LPM)",
-        "Per-Vessel Output TDS (optional)":"Per-Vessel Output TDS (optional)",
-        "Water Temperature (°C)":"Water Temperature (°C)","pH":"pH",
-        "Alkalinity as CaCO₃ (mg/L)":"Alkalinity as CaCO₃ (mg/L)","Hardness as CaCO₃ (mg/L)":"Hardness as CaCO₃ (mg/L)",
-        "SDI":"SDI","Turbidity (NTU)":"Turbidity (NTU)","TSS (mg/L)":"TSS (mg/L)","Free Chlorine (mg/L)":"Free Chlorine (mg/L)",
-        "CO₂ (mg/L)":"CO₂ (mg/L)","Silica (mg/L)":"Silica (mg/L)","HP Pump Efficiency (%)":"HP Pump Efficiency (%)",
-        "Calculate & Save":"Calculate & Save",
-        "Recovery %":"Recovery %","Rejection %":"Rejection %","Pressure Recovery %":"Pressure Recovery %",
-        "ΔP Cartridge (bar)":"ΔP Cartridge (bar)","ΔP Vessels (bar)":"ΔP Vessels (bar)","HP ΔP (bar)":"HP ΔP (bar)",
-        "PQI (0–100)":"PQI (0–100)","NDP (bar)":"NDP (bar)","Salt Passage (%)":"Salt Passage (%)","NPF (LPM)":"NPF (LPM)",
-        "Reject Flow (LPM) (calc)":"Reject Flow (LPM) (calc)","Mass Balance Error (%)":"Mass Balance Error (%)",
-        "Flow balance OK (Feed ≈ Product + Reject)":"Flow balance OK (Feed ≈ Product + Reject)",
-        "Flow mismatch: check meters/valves.":"Flow mismatch: check meters/valves.",
-        "Daily Note":"Daily Note","Field":"Field","Value":"Value","Metric":"Metric",
-        "Design summary":"Design summary","Design: {breakup} • Vessels: {tot_v} • Membranes: {tot_m}":"Design: {breakup} • Vessels: {tot_v} • Membranes: {tot_m}",
-        "Inputs":"Inputs","Outputs / KPIs":"Outputs / KPIs","Stage & Vessel Snapshot":"Stage & Vessel Snapshot",
-        "Vessel":"Vessel","Permeate TDS (ppm)":"Permeate TDS (ppm)","Rejection % (vessel)":"Rejection %",
-        "Download Daily Excel":"Download Daily Excel","Download Daily PDF":"Download Daily PDF",
-        "TDS Trend (last 30 days)":"TDS Trend (last 30 days)","Date (short)":"Date",
-        "Avg Feed TDS":"Avg Feed TDS","Avg Product TDS":"Avg Product TDS","Avg Recovery":"Avg Recovery","Avg Rejection":"Avg Rejection",
-        "Avg ΔP Cartridge":"Avg ΔP Cartridge","Avg ΔP Vessels":"Avg ΔP Vessels","Health Score":"Health Score",
-        "No data yet.":"No data yet.","Page":"Page"
-    },
-    "Arabic": {
-        "Language":"اللغة","Select Language":"اختر اللغة","Plant Setup":"إعداد المحطة","Number of Stages":"عدد المراحل",
-        "Vessels / Membranes":"الأوعية / الأغشية","Vessels":"أوعية",'Membranes per vessel (8")':'أغشية لكل وعاء (8")',
-        "Plant Capacity":"سعة المحطة","Design Recovery %":"نسبة الاسترجاع التصميمية",
-        "Dashboard":"لوحة التحكم","Daily Report":"تقرير يومي","Weekly Report":"تقرير أسبوعي","Monthly Report":"تقرير شهري",
-        "History & Exports":"السجل والتنزيلات","RO Design":"تصميم RO","RO Design — Quick Sizing":"تصميم RO — حساب سريع",
-        "Daily Inputs":"مدخلات يومية","Date":"التاريخ","Operator (optional)":"المشغل (اختياري)","Operator Notes":"ملاحظات المشغل",
-        "Feed TDS (ppm)":"TDS المغذي (ppm)","Product TDS (ppm)":"TDS المنتج (ppm)",
-        "Feed Pressure IN (bar)":"ضغط دخول المغذي (بار)","Feed Pressure OUT (bar)":"ضغط خروج المغذي (بار)",
-        "Cartridge Filter Pressure (bar)":"ضغط فلتر الخرطوشة (بار)","HP Pump IN (bar)":"دخول مضخة الضغط العالي (بار)","HP Pump OUT (بار)":"خروج مضخة الضغط العالي (بار)",
-        "Feed Flow (LPM)":"تدفق المغذي (ل/د)","Product Flow (LPM)":"تدفق المنتج (ل/د)",
-        "Per-Vessel Output TDS (optional)":"TDS لكل وعاء (اختياري)","Water Temperature (°C)":"درجة حرارة الماء (°م)","pH":"الرقم الهيدروجيني",
-        "Alkalinity as CaCO₃ (mg/L)":"القلوية كـ CaCO₃ (ملغم/ل)","Hardness as CaCO₃ (mg/L)":"الصلابة كـ CaCO₃ (ملغم/ل)",
-        "SDI":"SDI","Turbidity (NTU)":"العكارة (NTU)","TSS (mg/L)":"TSS (ملغم/ل)","Free Chlorine (mg/L)":"الكلور الحر (ملغم/ل)",
-        "CO₂ (mg/L)":"ثاني أكسيد الكربون (ملغم/ل)","Silica (mg/L)":"السيليكا (ملغم/ل)","HP Pump Efficiency (%)":"كفاءة مضخة الضغط العالي (%)",
-        "Calculate & Save":"احسب واحفظ",
-        "Recovery %":"نسبة الاسترجاع %","Rejection %":"نسبة الرفض %","Pressure Recovery %":"استرجاع الضغط %",
-        "ΔP Cartridge (bar)":"فرق الضغط عبر الخرطوشة (بار)","ΔP Vessels (bar)":"فرق الضغط عبر الأوعية (بار)","HP ΔP (bar)":"فرق ضغط المضخة العالية (بار)",
-        "PQI (0–100)":"مؤشر جودة النفاذ (0–100)","NDP (bar)":"الضغط الدافع الصافي (بار)","Salt Passage (%)":"مرور الأملاح (%)","NPF (LPM)":"التدفق المنظَّم (ل/د)",
-        "Reject Flow (LPM) (calc)":"تدفق الرفض (ل/د) (حساب)","Mass Balance Error (%)":"خطأ الاتزان الكتلي (%)",
-        "Flow balance OK (Feed ≈ Product + Reject)":"توازن التدفق جيد (المغذي ≈ المنتج + الرفض)","Flow mismatch: check meters/valves.":"اختلال التدفق: افحص العدادات/الصمامات.",
-        "Daily Note":"ملاحظة يومية","Field":"الحقل","Value":"القيمة","Metric":"المؤشر",
-        "Design summary":"ملخص التصميم","Design: {breakup} • Vessels: {tot_v} • Membranes: {tot_m}":"التصميم: {breakup} • الأوعية: {tot_v} • الأغشية: {tot_m}",
-        "Inputs":"المدخلات","Outputs / KPIs":"المخرجات / المؤشرات","Stage & Vessel Snapshot":"ملخص المراحل والأوعية",
-        "Vessel":"وعاء","Permeate TDS (ppm)":"TDS النفاذ (ppm)","Rejection % (vessel)":"نسبة الرفض",
-        "Download Daily Excel":"تنزيل إكسل اليومي","Download Daily PDF":"تنزيل PDF اليومي",
-        "TDS Trend (last 30 days)":"اتجاه TDS (آخر 30 يومًا)","Date (short)":"التاريخ",
-        "Avg Feed TDS":"متوسط TDS المغذي","Avg Product TDS":"متوسط TDS المنتج","Avg Recovery":"متوسط الاسترجاع","Avg Rejection":"متوسط الرفض",
-        "Avg ΔP Cartridge":"متوسط ΔP الخرطوشة","Avg ΔP Vessels":"متوسط ΔP الأوعية","Health Score":"مؤشر الصحة",
-        "No data yet.":"لا توجد بيانات بعد.","Page":"الصفحة"
-    }
-}
-def tr(s, lang): return T.get(lang, {}).get(s, s)
+LOCALES_DIR = APP_DIR / "locales"
+LANG_KEYS = ("English", "Arabic")
+
+@st.cache_resource(show_spinner=False)
+def load_locale(lang: str) -> MappingProxyType:
+    # one JSON file per language under locales/, parsed once per process
+    return MappingProxyType(_json_loads((LOCALES_DIR / f"{lang}.json").read_bytes()))
+
+@st.cache_resource(show_spinner=False)
+def _flat_translations() -> MappingProxyType:
+    # (lang, key) -> text with the English text baked in as fallback; built once per process, not per rerun
+    en = load_locale("English")
+    return MappingProxyType({(lang, sys.intern(k)): sys.intern(d.get(k) or en.get(k, k))
+                             for lang, d in ((l, load_locale(l)) for l in LANG_KEYS) for k in set(en) | set(d)})
+TX = _flat_translations()
+def tr(s, lang): return TX.get((lang, s), s)
 def tr_fmt(key, lang, **kw):
     s = tr(key, lang)
     try: return s.format(**kw)
     except Exception: return s
-def _(s: str) -> str: return tr(s, st.session_state.get("lang","English"))
-def _fmt(key: str, **kw): return tr_fmt(key, st.session_state.get("lang","English"), **kw)
+# labels used by the save handler and the PDF snapshot, resolved once per language
+_TR_KEYS = {
+    "recovery": "Recovery %",
+    "rejection": "Rejection %",
+    "press_rec": "Pressure Recovery %",
+    "dp_cart": "ΔP Cartridge (bar)",
+    "dp_vessels": "ΔP Vessels (bar)",
+    "hp_dp": "HP ΔP (bar)",
+    "reject_flow": "Reject Flow (LPM) (calc)",
+    "mass_bal": "Mass Balance Error (%)",
+    "pqi": "PQI (0–100)",
+    "npf": "NPF (LPM)",
+    "ndp": "NDP (bar)",
+    "salt_pass": "Salt Passage (%)",
+    "daily_note": "Daily Note",
+    "flow_ok": "Flow balance OK (Feed ≈ Product + Reject)",
+    "flow_bad": "Flow mismatch: check meters/valves.",
+    "snapshot": "Stage & Vessel Snapshot",
+    "perm_tds": "Permeate TDS (ppm)",
+    "rej_vessel": "Rejection % (vessel)",
+    "vessel": "Vessel",
+    "metric": "Metric",
+    "value": "Value",
+}
+@st.cache_resource(show_spinner=False)
+def _tr_table(lang: str) -> SimpleNamespace: return SimpleNamespace(**{k: tr(v, lang) for k, v in _TR_KEYS.items()})
+# both read the sidebar's `lang` global (first used after the selectbox), not st.session_state on every call
+def _(s: str) -> str: return TX.get((lang, s), s)
+def _fmt(key: str, **kw): return tr_fmt(key, lang, **kw)
+
+# static selector options, built once instead of on every rerun
+PAGE_KEYS = ("Dashboard", "Daily Report", "Weekly Report", "Monthly Report", "History & Exports", "RO Design")
+@st.cache_resource(show_spinner=False)
+def _page_labels(lang: str) -> tuple: return tuple(tr(k, lang) for k in PAGE_KEYS)
 
 # -------------------- sidebar --------------------
 with st.sidebar:
     st.header("🌐 " + tr("Language", "English"))
-    lang = st.selectbox(tr("Select Language", "English"), ["English","Arabic"], index=0)
+    lang = st.selectbox(tr("Select Language", "English"), LANG_KEYS, index=0)
 
 with st.sidebar:
     st.header("⚙ " + tr("Plant Setup", lang))
@@ -354,6 +531,12 @@ with st.sidebar:
 
 def m3d_to_lpm(m3d): return (m3d*1000.0)/1440.0
 
+@lru_cache(maxsize=32)
+def _design_summary(vps: tuple, mpv: int) -> tuple:
+    # (breakup, total vessels, total membranes) for a stage layout
+    tot_v = int(sum(vps))
+    return " | ".join([f"S{i+1}:{v}" for i,v in enumerate(vps)]), tot_v, tot_v*int(mpv)
+
 with st.sidebar:
     st.subheader("📊 " + tr("Plant Capacity", lang))
     plant_capacity = st.number_input(tr("Plant Capacity", lang) + " (m³/day)", 10, 20000, 500, 10)
@@ -361,12 +544,9 @@ with st.sidebar:
     d_feed = m3d_to_lpm(plant_capacity)
     d_prod = round(d_feed*(design_rec/100.0), 1)
     d_rej  = max(round(d_feed - d_prod, 1), 0.0)
-    st.caption(_fmt("Design: {breakup} • Vessels: {tot_v} • Membranes: {tot_m}",
-                    breakup=" | ".join([f"S{i+1}:{v}" for i,v in enumerate(vessels_per_stage)]),
-                    tot_v=int(sum(vessels_per_stage)),
-                    tot_m=int(sum(vessels_per_stage))*int(membranes_per_vessel)))
-    page_mode = st.radio(tr("Page", lang), [tr("Dashboard", lang), tr("Daily Report", lang), tr("Weekly Report", lang),
-                                            tr("Monthly Report", lang), tr("History & Exports", lang), tr("RO Design", lang)], index=0)
+    brk, tot_v, tot_m = _design_summary(tuple(vessels_per_stage), int(membranes_per_vessel))
+    st.caption(_fmt("Design: {breakup} • Vessels: {tot_v} • Membranes: {tot_m}", breakup=brk, tot_v=tot_v, tot_m=tot_m))
+    page_mode = st.radio(tr("Page", lang), _page_labels(lang), index=0)
 
 # persist
 st.session_state["lang"]=lang; st.session_state["page_mode"]=page_mode
@@ -377,12 +557,135 @@ st.session_state["design_rec"]=design_rec; st.session_state["plant_capacity"]=pl
 # -------------------- paths --------------------
 def plant_key(capacity_m3d: int) -> str:
     return f"{capacity_m3d}m3d_{st.session_state['num_stages']}stages"
-def user_csv_path(email: str, capacity_m3d: int) -> Path:
-    d = user_dir(email); return d / f"daily_{plant_key(capacity_m3d)}.csv"
+def user_daily_path(email: str, capacity_m3d: int) -> Path:
+    d = user_dir(email); return d / f"daily_{plant_key(capacity_m3d)}.jsonl"
 def user_reports_dir(email: str, kind: str) -> Path:
     return user_dir(email) / REPORTS_DIRNAME / kind
-def csv_path_for_current():
-    return user_csv_path(st.session_state.user_email, int(st.session_state["plant_capacity"]))
+def _jsonl_bytes(df: pd.DataFrame) -> bytes:
+    # pandas' C JSON writer emits the lines in one go: no per-row dict/tuple boxing (NaN -> null as before)
+    if df.empty: return b""
+    body = df.to_json(orient="records", lines=True, date_format="iso", force_ascii=False, double_precision=15).encode()
+    return body if body.endswith(b"\n") else body + b"\n"
+def _write_jsonl(path: Path, df: pd.DataFrame):
+    tmp = path.with_suffix(".tmp"); tmp.write_bytes(_jsonl_bytes(df)); tmp.replace(path)
+def _migrate_csv_to_jsonl(csv_p: Path, jsonl_p: Path):
+    # one-shot: older installs kept history as a rewritten CSV
+    _write_jsonl(jsonl_p, pd.read_csv(csv_p))
+def shard_path_for(base: Path, year: int) -> Path:
+    # history is sharded by year: daily_<plant>_2025.jsonl, daily_<plant>_2024.jsonl, ...
+    return base.with_name(f"{base.stem}_{year}.jsonl")
+def history_shards(base: Path, years=None) -> list:
+    shards = sorted(base.parent.glob(f"{base.stem}_[0-9][0-9][0-9][0-9].jsonl"))
+    return [p for p in shards if years is None or int(p.stem[-4:]) in years]
+def _split_into_year_shards(base: Path):
+    # one-shot: the single-file history becomes per-year shards (appended, so a re-run is harmless)
+    df = load_daily(str(base))
+    for year, g in (df.groupby(df["date"].astype(str).str[:4]) if not df.empty else []):
+        with shard_path_for(base, int(year)).open("ab") as f: f.write(_jsonl_bytes(g))
+    base.with_suffix(".parquet").unlink(missing_ok=True); base.unlink()
+def daily_path_for_current():
+    p = user_daily_path(st.session_state.user_email, int(st.session_state["plant_capacity"]))
+    legacy = p.with_suffix(".csv")
+    if not p.exists() and legacy.exists() and not history_shards(p): _migrate_csv_to_jsonl(legacy, p)
+    if p.exists(): _split_into_year_shards(p)
+    return p
+def append_daily(path: Path, row: dict):
+    # O(1) append; a re-saved date is resolved on read (last entry wins)
+    with path.open("ab") as f: f.write(_json_line(row))
+def _last_saved_date(path: Path):
+    # peek at the final line instead of parsing the whole shard
+    with path.open("rb") as f:
+        f.seek(0, 2); f.seek(max(f.tell()-4096, 0)); lines = f.read().splitlines()
+    for ln in reversed(lines):
+        if ln.strip():
+            try: return _json_loads(ln).get("date")
+            except Exception: return None  # cut-off line at the window edge
+    return None
+
+# numeric columns of the daily CSV, typed up front so pandas skips inference
+DAILY_DTYPES = {c: "float64" for c in [
+    "design_recovery", "feed_tds", "product_tds", "feed_p_in", "feed_p_out", "cartridge_p", "hp_in", "hp_out",
+    "feed_flow_lpm", "product_flow_lpm", "reject_flow_lpm", "recovery_pct", "rejection_pct", "pressure_recovery_pct",
+    "cartridge_dp", "vessel_dp", "hp_dp", "mass_balance_err_pct", "temp_c", "ph", "alkalinity_mgL", "hardness_mgL",
+    "sdi", "turbidity_ntu", "tss_mgL", "free_chlorine_mgL", "co2_mgL", "silica_mgL", "pump_efficiency_pct",
+    "tcf", "ndp_bar", "salt_passage_pct", "specific_energy_kwh_m3", "daily_kwh", "pqi", "npf_lpm"]}
+
+# columns the dashboard tiles read; the report pages render the whole frame
+DASHBOARD_COLS = ("date", "recovery_pct", "rejection_pct", "pressure_recovery_pct", "cartridge_dp", "vessel_dp", "product_tds")
+
+def _jsonl_version(path_str: str) -> bytes:
+    # (mtime_ns, size) of the log: an append always changes the size, even inside one coarse mtime tick
+    stt = os.stat(path_str); return f"{stt.st_mtime_ns}:{stt.st_size}".encode()
+
+def _write_parquet(snap: Path, df: pd.DataFrame, version: bytes):
+    # typed columnar snapshot of the merged history, stamped with the JSONL version it was built from;
+    # the JSONL log stays the source of truth
+    fd, tmp = tempfile.mkstemp(dir=snap.parent, prefix=snap.name + ".", suffix=".tmp"); os.close(fd)
+    tmp = Path(tmp)  # unique per writer: concurrent sessions can't overwrite each other's half-written file
+    try:
+        t = pa.Table.from_pandas(df, preserve_index=False)
+        pq.write_table(t.replace_schema_metadata({**(t.schema.metadata or {}), b"jsonl_version": version}), tmp, compression="snappy")
+        tmp.replace(snap)
+    except Exception: tmp.unlink(missing_ok=True)
+
+def load_daily(path_str: str, cols: tuple = None, use_snapshot: bool = True) -> pd.DataFrame:
+    snap = Path(path_str).with_suffix(".parquet")
+    version = _jsonl_version(path_str)  # taken before parsing: a concurrent append leaves the snapshot marked stale
+    if PARQUET_OK and use_snapshot and snap.exists():
+        try:
+            schema = pq.read_schema(snap)
+            if (schema.metadata or {}).get(b"jsonl_version") == version:  # built from exactly this log: read only the requested columns
+                return pd.read_parquet(snap, columns=[c for c in cols if c in schema.names] if cols else None)
+        except Exception: pass  # unreadable/replaced snapshot: fall back to the JSONL log and rebuild it
+    with open(path_str, "rb") as f:
+        df = pd.DataFrame.from_records([_json_loads(ln) for ln in f if ln.strip()])
+    if df.empty: return df
+    if cols and not PARQUET_OK: df = df[[c for c in cols if c in df.columns]]  # project before the cast/backfill passes
+    df = df.drop_duplicates(subset="date", keep="last").sort_values("date").reset_index(drop=True)
+    df = backfill_kpis(df.astype({c: t for c, t in DAILY_DTYPES.items() if c in df.columns}))
+    if PARQUET_OK: _write_parquet(snap, df, version)
+    return df[[c for c in cols if c in df.columns]] if cols else df
+
+@st.cache_data(show_spinner=False, ttl=24*60*60)
+def _read_daily(path_str: str, version: bytes) -> pd.DataFrame:
+    # version is only part of the cache key: a save changes it and forces a fresh parse
+    return load_daily(path_str)
+
+@st.cache_data(show_spinner=False)
+def _load_history(path_str: str, version: bytes, cols: tuple = None) -> pd.DataFrame:
+    # report pages: parsed once per file version; dates stay datetime64 (no per-row date objects)
+    df = load_daily(path_str, cols)
+    if not df.empty: df["date"] = pd.to_datetime(df["date"])
+    return df
+
+def _append_or_replace_row(path: Path, row: dict):
+    # fast path is a one-line append; only re-saving an existing date compacts the file
+    last = _last_saved_date(path) if path.exists() else None
+    if last is not None and row["date"] > last:
+        append_daily(path, row)  # newer than the tail: nothing to look up
+    else:
+        existing = _read_daily(str(path), _jsonl_version(str(path))) if path.exists() else None
+        append_daily(path, row)
+        if existing is not None and not existing.empty and (existing["date"].astype(str) == row["date"]).any():
+            # compaction always re-parses the log (never the snapshot), so the row just appended is kept
+            _write_jsonl(path, load_daily(str(path), use_snapshot=False))
+    _read_daily.clear(); _load_history.clear(); _concat_history.clear()
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def _concat_history(keys: tuple, cols: tuple = None) -> pd.DataFrame:
+    # keyed on every shard's (path, version): filter widgets on the report pages rerun against this, not a fresh concat
+    frames = [f for f in (_load_history(p, v, cols) for p, v in keys) if not f.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def _date_slice(df: pd.DataFrame, lo, hi, inclusive_hi: bool = True) -> pd.DataFrame:
+    # history frames come out date-sorted (year shards, each sorted on load): binary-search the bounds instead of masking every row
+    if df.empty: return df
+    d = df["date"].to_numpy()
+    return df.iloc[d.searchsorted(np.datetime64(lo), "left"):d.searchsorted(np.datetime64(hi), "right" if inclusive_hi else "left")]
+
+def load_history(shards: list, cols: tuple = None) -> pd.DataFrame:
+    # each shard is cached on its own (mtime_ns, size), so a save only re-parses the current year
+    return _concat_history(tuple((str(p), _jsonl_version(str(p))) for p in shards), cols)
 
 # -------------------- KPI helpers --------------------
 def safe_div(a,b): b=1e-9 if (b in (None,0)) else b; a=0.0 if a is None else a; return a/b
@@ -401,7 +704,8 @@ def temperature_correction_factor(temp_c): return max(0.6, min(1.6, 1.0 + 0.03*(
 def osmotic_pressure_approx(tds_mgL, temp_c): T=temp_c+273.15; return 0.0008*max(tds_mgL,0.0)*(T/298.0)
 def net_driving_pressure_bar(hp_out_bar, feed_out_bar, feed_tds, prod_tds, temp_c):
     deltaP=max(hp_out_bar - feed_out_bar, 0.0)
-    return max(deltaP - (osmotic_pressure_approx(feed_tds,temp_c) - osmotic_pressure_approx(prod_tds,temp_c)), 0.0)
+    k=0.0008*(temp_c+273.15)/298.0  # shared osmotic coefficient for feed and permeate
+    return max(deltaP - k*(max(feed_tds,0.0) - max(prod_tds,0.0)), 0.0)
 def specific_energy_kwh_m3(hp_out_bar, feed_flow_lpm, efficiency_pct, product_flow_lpm):
     Q_ls=max(feed_flow_lpm,0.0)/60.0; eta=max(efficiency_pct/100.0,0.01)
     kW=(hp_out_bar*Q_ls)/(36.0*eta); prod_m3_h=(product_flow_lpm*60)/1000.0
@@ -411,111 +715,181 @@ def permeate_quality_index(product_tds, target_tds=50.0):
     return max(0.0, 100.0 - min(100.0, (product_tds/max(target_tds,1e-6))*100.0))
 def normalized_permeate_flow(permeate_flow_lpm, tcf): return safe_div(permeate_flow_lpm, tcf)
 
+# array versions of the KPI helpers above (whole DataFrame columns in one pass)
+def _arr(x): return np.asarray(x, dtype=float)
+def kpi_recovery_pct_arr(product_lpm, feed_lpm):
+    feed=_arr(feed_lpm); return np.clip(_arr(product_lpm)/np.where(feed==0, 1e-9, feed)*100.0, 0.0, 100.0)
+def kpi_rejection_pct_arr(prod_tds, feed_tds):
+    # NaN wherever there is no positive upstream TDS; the divide only touches valid slots
+    feed=_arr(feed_tds); ratio=np.divide(_arr(prod_tds), feed, out=np.full_like(feed, np.nan), where=feed>0)
+    return np.clip((1.0 - ratio)*100.0, 0.0, 100.0)
+def temperature_correction_factor_arr(temp_c): return np.clip(1.0 + 0.03*(_arr(temp_c)-25.0), 0.6, 1.6)
+def osmotic_pressure_approx_arr(tds_mgL, temp_c): return 0.0008*np.maximum(_arr(tds_mgL), 0.0)*((_arr(temp_c)+273.15)/298.0)
+def permeate_quality_index_arr(product_tds, target_tds=50.0):
+    return np.maximum(0.0, 100.0 - np.minimum(100.0, _arr(product_tds)/max(target_tds,1e-6)*100.0))
+
+# compiled row kernels for history-wide KPIs (plain loops when numba is absent)
+@njit(cache=True, parallel=NUMBA_OK)
+def ndp_arr(hp_out, feed_out, feed_tds, prod_tds, temp_c):
+    out = np.empty_like(hp_out)
+    for i in prange(out.shape[0]):
+        dP = max(hp_out[i]-feed_out[i], 0.0)
+        tf = 0.0008*(temp_c[i]+273.15)/298.0
+        out[i] = max(dP - tf*(max(feed_tds[i],0.0) - max(prod_tds[i],0.0)), 0.0)
+    return out
+
+@njit(cache=True, parallel=NUMBA_OK)
+def specific_energy_arr(hp_out, feed_flow_lpm, efficiency_pct, product_flow_lpm):
+    out = np.empty_like(hp_out)
+    for i in prange(out.shape[0]):
+        kW = (hp_out[i]*max(feed_flow_lpm[i],0.0)/60.0)/(36.0*max(efficiency_pct[i]/100.0,0.01))
+        out[i] = kW / max(product_flow_lpm[i]*60.0/1000.0, 1e-6)
+    return out
+
+@njit(cache=True, parallel=NUMBA_OK)
+def npf_arr(permeate_flow_lpm, temp_c):
+    out = np.empty_like(permeate_flow_lpm)
+    for i in prange(out.shape[0]):
+        tcf = min(1.6, max(0.6, 1.0 + 0.03*(temp_c[i]-25.0)))
+        out[i] = permeate_flow_lpm[i]/tcf
+    return out
+
+def backfill_kpis(df: pd.DataFrame) -> pd.DataFrame:
+    """Fill derived KPI columns that older/partial rows are missing, column-wise."""
+    def col(c): return df[c].to_numpy(dtype=np.float64)
+    def fill(name, inputs, kernel):
+        if not all(c in df.columns for c in inputs): return
+        if name in df.columns and not df[name].isna().any(): return
+        vals = pd.Series(kernel(*[col(c) for c in inputs]), index=df.index)
+        df[name] = df[name].fillna(vals) if name in df.columns else vals
+    fill("ndp_bar", ["hp_out","feed_p_out","feed_tds","product_tds","temp_c"], ndp_arr)
+    fill("specific_energy_kwh_m3", ["hp_out","feed_flow_lpm","pump_efficiency_pct","product_flow_lpm"], specific_energy_arr)
+    fill("npf_lpm", ["product_flow_lpm","temp_c"], npf_arr)
+    return df
+
 DEFAULT_LIMITS = {
     "product_tds_max": 60.0, "cartridge_dp_max": 0.7, "vessel_dp_max": 1.5,
     "rejection_min": 60.0, "recovery_target": 70.0, "recovery_high_margin": 3.0
 }
 
+# Advanced daily inputs: (key, label, min, max, default)
+ADVANCED_FIELDS = [
+    ("temp_c", "Water Temperature (°C)", 1.0, 50.0, 25.0),
+    ("ph", "pH", 1.0, 14.0, 7.2),
+    ("alkalinity_mgL", "Alkalinity as CaCO₃ (mg/L)", 0.0, 1000.0, 120.0),
+    ("hardness_mgL", "Hardness as CaCO₃ (mg/L)", 0.0, 3000.0, 200.0),
+    ("sdi", "SDI", 0.0, 10.0, 3.0),
+    ("turbidity_ntu", "Turbidity (NTU)", 0.0, 1000.0, 0.5),
+    ("tss_mgL", "TSS (mg/L)", 0.0, 5000.0, 5.0),
+    ("free_chlorine_mgL", "Free Chlorine (mg/L)", 0.0, 10.0, 0.0),
+    ("co2_mgL", "CO₂ (mg/L)", 0.0, 100.0, 5.0),
+    ("silica_mgL", "Silica (mg/L)", 0.0, 200.0, 10.0),
+    ("pump_efficiency", "HP Pump Efficiency (%)", 30.0, 90.0, 75.0),
+]
+
+# (field, fallback when missing, comparison, DEFAULT_LIMITS key, tip), checked in one pass
+MAINTENANCE_RULES = (
+    ("rejection_pct", 100, operator.lt, "rejection_min", "Rejection below target → inspect for fouling/bypass; plan alkaline+acid CIP."),
+    ("product_tds", 0, operator.gt, "product_tds_max", "Product TDS high → check integrity (O-rings, interconnects), tighten concentrate valve."),
+    ("cartridge_dp", 0, operator.gt, "cartridge_dp_max", "Cartridge ΔP high → replace cartridge / check clogging upstream."),
+    ("vessel_dp", 0, operator.gt, "vessel_dp_max", "Vessel ΔP high → channeling/scaling risk; verify brine flow & antiscalant."),
+)
+FLOW_IMBALANCE_NOTE = "Flow imbalance noted → verify flowmeters & throttling set-points."
+HEALTHY_NOTE = "Inputs vs outputs look healthy today. Keep PM on schedule (cartridge & CIP planning)."
+
 def maintenance_note_from_row(row, limits=DEFAULT_LIMITS):
-    tips=[]
-    if (row.get("rejection_pct") or 100) < limits["rejection_min"]:
-        tips.append("Rejection below target → inspect for fouling/bypass; plan alkaline+acid CIP.")
-    if (row.get("product_tds") or 0) > limits["product_tds_max"]:
-        tips.append("Product TDS high → check integrity (O-rings, interconnects), tighten concentrate valve.")
-    if (row.get("cartridge_dp") or 0) > limits["cartridge_dp_max"]:
-        tips.append("Cartridge ΔP high → replace cartridge / check clogging upstream.")
-    if (row.get("vessel_dp") or 0) > limits["vessel_dp_max"]:
-        tips.append("Vessel ΔP high → channeling/scaling risk; verify brine flow & antiscalant.")
-    if not row.get("feed_vs_sum_ok", True):
-        tips.append("Flow imbalance noted → verify flowmeters & throttling set-points.")
-    if not tips:
-        tips.append("Inputs vs outputs look healthy today. Keep PM on schedule (cartridge & CIP planning).")
-    return " ".join(tips)
+    tips = [tip for f, fb, op, lim, tip in MAINTENANCE_RULES if op(row.get(f) or fb, limits[lim])]
+    if not row.get("feed_vs_sum_ok", True): tips.append(FLOW_IMBALANCE_NOTE)  # missing flag = balanced
+    return " ".join(tips) if tips else HEALTHY_NOTE
 
 # -------------------- header --------------------
-st.title(f"{BRAND} • RO Dashboard")
-st.markdown(f'<span class="lee-badge">User: {st.session_state.user_email}</span>', unsafe_allow_html=True)
-brk = " | ".join([f"S{i+1}:{v}" for i,v in enumerate(st.session_state["vessels_per_stage"])])
-tot_v = int(sum(st.session_state["vessels_per_stage"]))
-tot_m = int(tot_v * st.session_state["membranes_per_vessel"])
+# page title + user badge as one markdown element
+st.markdown(f'# {BRAND} • RO Dashboard\n<span class="lee-badge">User: {st.session_state.user_email}</span>', unsafe_allow_html=True)
+brk, tot_v, tot_m = _design_summary(tuple(st.session_state["vessels_per_stage"]), int(st.session_state["membranes_per_vessel"]))
 st.caption(_fmt("Design: {breakup} • Vessels: {tot_v} • Membranes: {tot_m}", breakup=brk, tot_v=tot_v, tot_m=tot_m))
 
 # ---------- DASHBOARD QUICK KPIs ----------
-if st.session_state["page_mode"] == tr("Dashboard", st.session_state["lang"]):
-    path = csv_path_for_current()
+if st.session_state["page_mode"] == tr("Dashboard", lang):
+    shards = history_shards(daily_path_for_current())
     c1,c2,c3,c4,c5,c6 = st.columns(6)
-    if path.exists():
-        df = pd.read_csv(path)
+    if shards:
+        df = load_history(shards[-1:], DASHBOARD_COLS)
         if not df.empty:
-            last = df.iloc[-1]
+            last = df.iloc[-1].to_dict()  # one row -> plain dict; the tiles below are dict gets, not Series label lookups
             with c1: st.metric(_("Recovery %"), f"{last.get('recovery_pct',0):.1f}")
             with c2: st.metric(_("Rejection %"), f"{last.get('rejection_pct',0):.1f}")
             with c3: st.metric(_("Pressure Recovery %"), f"{last.get('pressure_recovery_pct',0):.1f}")
             with c4: st.metric(_("ΔP Cartridge (bar)"), f"{last.get('cartridge_dp',0):.2f}")
             with c5: st.metric(_("ΔP Vessels (bar)"), f"{last.get('vessel_dp',0):.2f}")
-            pqi = permeate_quality_index(last.get("product_tds",0))
-            with c6: st.metric(_("PQI (0–100)"), f"{(pqi or 0):.0f}/100")
+            # a blank product TDS stays NaN through the kernel: show "—" rather than a perfect score
+            pqi = permeate_quality_index_arr(df["product_tds"].to_numpy(dtype=float)[-1:])[0] if "product_tds" in df else np.nan
+            with c6: st.metric(_("PQI (0–100)"), "—" if np.isnan(pqi) else f"{pqi:.0f}/100")
         else:
             c1.write(_("No data yet."))
     else:
         c1.write(_("No data yet."))
 
 # ---------- DAILY REPORT ----------
-if st.session_state["page_mode"] == tr("Daily Report", st.session_state["lang"]):
+if st.session_state["page_mode"] == tr("Daily Report", lang):
     st.markdown("### 🗓 " + _("Daily Inputs"))
 
-    colA,colB,colC = st.columns(3)
-    with colA:
-        report_date = st.date_input(_("Date"), value=date.today())
-        operator = st.text_input(_("Operator (optional)"), "")
-        feed_tds = st.number_input(_("Feed TDS (ppm)"), 1.0, 200000.0, 120.0, 1.0)
-        product_tds = st.number_input(_("Product TDS (ppm)"), 0.1, 200000.0, 45.0, 0.1)
-    with colB:
-        feed_p_in  = st.number_input(_("Feed Pressure IN (bar)"), 0.0, 100.0, 1.2, 0.1)
-        feed_p_out = st.number_input(_("Feed Pressure OUT (bar)"),0.0, 100.0, 1.0, 0.1)
-        cartridge_p = st.number_input(_("Cartridge Filter Pressure (bar)"), 0.0, 100.0, 1.7, 0.1)
-        hp_in  = st.number_input(_("HP Pump IN (bar)"), 0.0, 200.0, 2.0, 0.1)
-        hp_out = st.number_input(_("HP Pump OUT (bar)"),0.0, 200.0, 12.0, 0.1)
-    with colC:
-        design_feed = (st.session_state["plant_capacity"]*1000.0/1440.0)
-        design_prod = round(design_feed*(st.session_state["design_rec"]/100.0), 1)
-        feed_flow   = st.number_input(_("Feed Flow (LPM)"),    1.0, 200000.0, float(design_feed), 1.0)
-        product_flow= st.number_input(_("Product Flow (LPM)"), 0.1, 200000.0, float(design_prod), 0.1)
-        notes_free  = st.text_area(_("Operator Notes"), "")
-
-    # per-vessel readings (optional). We compute stage averages automatically.
-    per_vessel_rows=[]
-    with st.expander(_("Per-Vessel Output TDS (optional)")):
-        for s_idx, vessels in enumerate(st.session_state["vessels_per_stage"], start=1):
-            st.caption(f"Stage {s_idx} — {vessels} vessel(s)")
-            cols = st.columns(min(6, max(1, vessels)))
-            for v in range(1, vessels+1):
-                col = cols[(v-1)%len(cols)]
-                with col:
-                    val = st.number_input(f"S{s_idx} V{v} " + _("Permeate TDS (ppm)"), 0.1, 200000.0,
-                                          float(product_tds), 0.1, key=f"s{s_idx}_v{v}")
-                per_vessel_rows.append({"Stage": s_idx, "Vessel": v, "Permeate TDS (ppm)": float(val)})
-
-    # advanced water/operation
-    with st.expander("Advanced"):
-        col1,col2,col3 = st.columns(3)
-        with col1:
-            temp_c = st.number_input(_("Water Temperature (°C)"), 1.0, 50.0, 25.0, 0.5)
-            ph = st.number_input(_("pH"), 1.0, 14.0, 7.2, 0.1)
-            alkalinity_mgL = st.number_input(_("Alkalinity as CaCO₃ (mg/L)"), 0.0, 1000.0, 120.0, 1.0)
-            hardness_mgL   = st.number_input(_("Hardness as CaCO₃ (mg/L)"), 0.0, 3000.0, 200.0, 1.0)
-        with col2:
-            sdi = st.number_input(_("SDI"), 0.0, 10.0, 3.0, 0.1)
-            turbidity_ntu = st.number_input(_("Turbidity (NTU)"), 0.0, 1000.0, 0.5, 0.1)
-            tss_mgL = st.number_input(_("TSS (mg/L)"), 0.0, 5000.0, 5.0, 0.5)
-            free_chlorine_mgL = st.number_input(_("Free Chlorine (mg/L)"), 0.0, 10.0, 0.0, 0.1)
-        with col3:
-            co2_mgL = st.number_input(_("CO₂ (mg/L)"), 0.0, 100.0, 5.0, 0.5)
-            silica_mgL = st.number_input(_("Silica (mg/L)"), 0.0, 200.0, 10.0, 0.5)
-            pump_efficiency = st.number_input(_("HP Pump Efficiency (%)"), 30.0, 90.0, 75.0, 1.0)
+    # one form: widget edits no longer rerun the page until "Calculate & Save" is pressed
+    with st.form("daily_inputs"):
+        colA,colB,colC = st.columns(3)
+        with colA:
+            report_date = st.date_input(_("Date"), value=date.today())
+            operator_name = st.text_input(_("Operator (optional)"), "")
+            feed_tds = st.number_input(_("Feed TDS (ppm)"), 1.0, 200000.0, 120.0, 1.0)
+            product_tds = st.number_input(_("Product TDS (ppm)"), 0.1, 200000.0, 45.0, 0.1)
+        with colB:
+            feed_p_in  = st.number_input(_("Feed Pressure IN (bar)"), 0.0, 100.0, 1.2, 0.1)
+            feed_p_out = st.number_input(_("Feed Pressure OUT (bar)"),0.0, 100.0, 1.0, 0.1)
+            cartridge_p = st.number_input(_("Cartridge Filter Pressure (bar)"), 0.0, 100.0, 1.7, 0.1)
+            hp_in  = st.number_input(_("HP Pump IN (bar)"), 0.0, 200.0, 2.0, 0.1)
+            hp_out = st.number_input(_("HP Pump OUT (bar)"),0.0, 200.0, 12.0, 0.1)
+        with colC:
+            design_feed = (st.session_state["plant_capacity"]*1000.0/1440.0)
+            design_prod = round(design_feed*(st.session_state["design_rec"]/100.0), 1)
+            feed_flow   = st.number_input(_("Feed Flow (LPM)"),    1.0, 200000.0, float(design_feed), 1.0)
+            product_flow= st.number_input(_("Product Flow (LPM)"), 0.1, 200000.0, float(design_prod), 0.1)
+            notes_free  = st.text_area(_("Operator Notes"), "")
+
+        # per-vessel readings (optional). We compute stage averages automatically.
+        # stored as parallel arrays (stage, vessel, TDS) instead of a list of dicts
+        vps = st.session_state["vessels_per_stage"]
+        n_vessels = int(sum(vps))
+        stage_ids  = np.repeat(np.arange(1, len(vps)+1, dtype=np.int16), vps)
+        vessel_ids = (np.arange(n_vessels) - np.repeat(np.cumsum([0]+list(vps[:-1])), vps) + 1).astype(np.int16)
+        # per-vessel readings: one editable table instead of a number input per vessel
+        with st.expander(_("Per-Vessel Output TDS (optional)")):
+            col_tds = _("Permeate TDS (ppm)")
+            pv_edit = st.data_editor(pd.DataFrame({"Stage": stage_ids, "Vessel": vessel_ids, col_tds: np.full(n_vessels, float(product_tds))}),
+                                     hide_index=True, num_rows="fixed", disabled=["Stage","Vessel"],
+                                     use_container_width=True, key="vessel_editor",
+                                     column_config={col_tds: st.column_config.NumberColumn(col_tds, min_value=0.1, max_value=200000.0, step=0.1)})
+            vessel_tds = np.clip(pv_edit[col_tds].fillna(float(product_tds)).to_numpy(dtype=np.float64), 0.1, 200000.0)
+
+        # advanced water/operation: one editable table instead of 11 number inputs
+        with st.expander("Advanced"):
+            adv_df = pd.DataFrame({"Field": [_(lbl) for _k, lbl, _lo, _hi, _d in ADVANCED_FIELDS],
+                                   "Value": [float(d) for _k, _l, _lo, _hi, d in ADVANCED_FIELDS]})
+            adv_edit = st.data_editor(adv_df, hide_index=True, num_rows="fixed", disabled=["Field"],
+                                      use_container_width=True, key="advanced_editor",
+                                      column_config={"Value": st.column_config.NumberColumn(_("Value"), min_value=0.0, step=0.1)})
+            # per-row bounds (the editor only takes one range per column)
+            adv = {k: float(min(max(v if pd.notna(v) else d, lo), hi))
+                   for (k, _l, lo, hi, d), v in zip(ADVANCED_FIELDS, adv_edit["Value"].tolist())}
+            temp_c, ph = adv["temp_c"], adv["ph"]
+            alkalinity_mgL, hardness_mgL = adv["alkalinity_mgL"], adv["hardness_mgL"]
+            sdi, turbidity_ntu, tss_mgL = adv["sdi"], adv["turbidity_ntu"], adv["tss_mgL"]
+            free_chlorine_mgL, co2_mgL, silica_mgL = adv["free_chlorine_mgL"], adv["co2_mgL"], adv["silica_mgL"]
+            pump_efficiency = adv["pump_efficiency"]
+        # the trend sheet + chart is the priciest part of the workbook; only build it when asked for
+        want_trend = st.checkbox(_("Add 30-day trend sheet to Excel"), value=False, key="want_trend")
+        submitted = st.form_submit_button(_("Calculate & Save"))
 
     # ==== Compute & Save ====
-    if st.button(_("Calculate & Save")):
+    if submitted:
         # Reject flow (auto) + mass balance
         reject_flow = max(feed_flow - product_flow, 0.0)
         mass_balance_err = ((product_flow + reject_flow) - feed_flow) / max(feed_flow,1e-6) * 100.0
@@ -528,31 +902,17 @@ if st.session_state["page_mode"] == tr("Daily Report", st.session_state["lang"])
         hp_dp         = kpi_delta_p(hp_out, hp_in)
         press_rec_pct = pressure_recovery_pct(hp_in, hp_out)
 
-        # Stage averages from per-vessel (if provided)
-        stage_avg = {}
-        if len(per_vessel_rows) > 0:
-            for s in range(1, st.session_state["num_stages"]+1):
-                vals = [r["Permeate TDS (ppm)"] for r in per_vessel_rows if r["Stage"]==s]
-                if vals:
-                    avg_tds = float(np.mean(vals))
-                    up_tds = feed_tds if s==1 else stage_avg.get(s-1, {}).get("avg_tds", feed_tds)
-                    rej = kpi_rejection_pct(avg_tds, up_tds)
-                    stage_avg[s] = {"avg_tds": avg_tds, "rejection_pct": rej}
-                else:
-                    stage_avg[s] = {"avg_tds": None, "rejection_pct": None}
-
-        # Per-vessel DataFrame with rejection % (vs upstream stage)
-        COL_PERM = _("Permeate TDS (ppm)")
-        COL_REJ  = _("Rejection % (vessel)")
-        per_vessel_df = pd.DataFrame(columns=["Stage","Vessel", COL_PERM, COL_REJ])
-        if per_vessel_rows:
-            rows=[]
-            for r in per_vessel_rows:
-                s = r["Stage"]
-                upstream_tds = feed_tds if s==1 else (stage_avg.get(s-1, {}).get("avg_tds") or feed_tds)
-                rej = kpi_rejection_pct(r["Permeate TDS (ppm)"], upstream_tds)
-                rows.append({"Stage": s, "Vessel": r["Vessel"], COL_PERM: r["Permeate TDS (ppm)"], COL_REJ: rej})
-            per_vessel_df = pd.DataFrame(rows).sort_values(["Stage","Vessel"]).reset_index(drop=True)
+        # Stage averages from per-vessel (if provided): one groupby; upstream of stage s is stage s-1's mean
+        L = _tr_table(lang)
+        COL_PERM, COL_REJ = L.perm_tds, L.rej_vessel
+        pv = pd.DataFrame({"Stage": stage_ids, "Vessel": vessel_ids, COL_PERM: vessel_tds})
+        stage_means = pv.groupby("Stage")[COL_PERM].mean()
+        upstream = stage_means.shift(1, fill_value=feed_tds)
+        stage_rej = kpi_rejection_pct_arr(stage_means, upstream)
+        vessel_rej = kpi_rejection_pct_arr(vessel_tds, upstream.reindex(stage_ids).to_numpy())
+
+        # Per-vessel DataFrame with rejection % (vs upstream stage); inputs are filled in stage/vessel order
+        per_vessel_df = pv.assign(**{COL_REJ: vessel_rej})
 
         # More KPIs
         tcf = temperature_correction_factor(temp_c)
@@ -565,10 +925,10 @@ if st.session_state["page_mode"] == tr("Daily Report", st.session_state["lang"])
         npf = normalized_permeate_flow(product_flow, tcf)
 
         # collect row
-        path = csv_path_for_current()
+        base = daily_path_for_current(); path = shard_path_for(base, report_date.year)
         row = {
             "date": report_date.strftime("%Y-%m-%d"),
-            "user": st.session_state.user_email, "operator": operator,
+            "user": st.session_state.user_email, "operator": operator_name,
             "capacity_m3d": int(st.session_state["plant_capacity"]),
             "design_recovery": float(st.session_state["design_rec"]),
             "stage_count": int(st.session_state["num_stages"]),
@@ -597,51 +957,41 @@ if st.session_state["page_mode"] == tr("Daily Report", st.session_state["lang"])
             "specific_energy_kwh_m3": float(spec_energy), "daily_kwh": float(daily_kwh),
             "pqi": float(pqi) if pqi is not None else None, "npf_lpm": float(npf)
         }
-        for i in range(1, st.session_state["num_stages"]+1):
-            st_avg = stage_avg.get(i, {})
-            row[f"stage_{i}_avg_tds"]=float(st_avg.get("avg_tds")) if st_avg.get("avg_tds") is not None else None
-            rj = st_avg.get("rejection_pct")
-            row[f"stage_{i}_rejection_pct"]=float(rj) if rj is not None else None
+        # stage suffix fields straight from the groupby arrays (None where a stage has no reading)
+        stages = range(1, st.session_state["num_stages"]+1)
+        row.update({f"stage_{i}_{k}": None for i in stages for k in ("avg_tds", "rejection_pct")})
+        row.update({f"stage_{i}_avg_tds": m for i, m in zip(stage_means.index.tolist(), stage_means.tolist())})
+        row.update({f"stage_{i}_rejection_pct": (r if np.isfinite(r) else None) for i, r in zip(stage_means.index.tolist(), stage_rej.tolist())})
 
         row["maintenance_note"] = maintenance_note_from_row(row)
 
-        # save / merge
-        df_new=pd.DataFrame([row])
-        if path.exists():
-            df_old=pd.read_csv(path); df_old["date"]=df_old["date"].astype(str)
-            df_all=pd.concat([df_old[df_old["date"]!=row["date"]], df_new], ignore_index=True).sort_values("date")
-        else:
-            df_all=df_new
-        df_all.to_csv(path, index=False)
+        # save (append-only JSONL) and reload the merged history
+        _append_or_replace_row(path, row)
+        df_all = load_history(history_shards(base)[-2:])  # enough for the 30-day trend
         st.success(f"Saved to {path.name}")
 
-        # KPI cards
-        c1,c2,c3,c4,c5,c6 = st.columns(6)
-        with c1: st.metric(_("Recovery %"), f"{row['recovery_pct']:.1f}")
-        with c2: st.metric(_("Rejection %"), f"{(row['rejection_pct'] or 0):.1f}")
-        with c3: st.metric(_("Pressure Recovery %"), f"{(row['pressure_recovery_pct'] or 0):.1f}")
-        with c4: st.metric(_("ΔP Cartridge (bar)"), f"{(row['cartridge_dp'] or 0):.2f}")
-        with c5: st.metric(_("ΔP Vessels (bar)"), f"{(row['vessel_dp'] or 0):.2f}")
-        with c6: st.metric(_("HP ΔP (bar)"), f"{(row['hp_dp'] or 0):.2f}")
-
-        a1,a2,a3,a4,a5,a6 = st.columns(6)
-        with a1: st.metric(_("Reject Flow (LPM) (calc)"), f"{row['reject_flow_lpm']:.1f}")
-        with a2: st.metric(_("Mass Balance Error (%)"), f"{row['mass_balance_err_pct']:.2f}")
-        with a3: st.metric(_("PQI (0–100)"), f"{(row['pqi'] or 0):.0f}")
-        with a4: st.metric(_("NPF (LPM)"), f"{row['npf_lpm']:.1f}")
-        with a5: st.metric(_("NDP (bar)"), f"{row['ndp_bar']:.2f}")
-        with a6: st.metric(_("Salt Passage (%)"), f"{row['salt_passage_pct']:.2f}")
+        # KPI cards: one fixed 2x6 grid, so repeated saves update the same elements in place
+        kpi_cards = [
+            (L.recovery, f"{row['recovery_pct']:.1f}"), (L.rejection, f"{(row['rejection_pct'] or 0):.1f}"),
+            (L.press_rec, f"{(row['pressure_recovery_pct'] or 0):.1f}"), (L.dp_cart, f"{(row['cartridge_dp'] or 0):.2f}"),
+            (L.dp_vessels, f"{(row['vessel_dp'] or 0):.2f}"), (L.hp_dp, f"{(row['hp_dp'] or 0):.2f}"),
+            (L.reject_flow, f"{row['reject_flow_lpm']:.1f}"), (L.mass_bal, f"{row['mass_balance_err_pct']:.2f}"),
+            (L.pqi, f"{(row['pqi'] or 0):.0f}"), (L.npf, f"{row['npf_lpm']:.1f}"),
+            (L.ndp, f"{row['ndp_bar']:.2f}"), (L.salt_pass, f"{row['salt_passage_pct']:.2f}"),
+        ]
+        for r0 in (0, 6):
+            for col, (label, val) in zip(st.columns(6), kpi_cards[r0:r0+6]): col.metric(label, val)
 
         # Maintenance & balance
-        st.markdown(f"<div class='warn'><b>{_('Daily Note')}:</b> {row['maintenance_note']}</div>", unsafe_allow_html=True)
+        st.markdown(f"<div class='warn'><b>{L.daily_note}:</b> {row['maintenance_note']}</div>", unsafe_allow_html=True)
         if row["feed_vs_sum_ok"]:
-            st.markdown("<div class='good'>" + _("Flow balance OK (Feed ≈ Product + Reject)") + "</div>", unsafe_allow_html=True)
+            st.markdown("<div class='good'>" + L.flow_ok + "</div>", unsafe_allow_html=True)
         else:
-            st.markdown("<div class='bad'>" + _("Flow mismatch: check meters/valves.") + "</div>", unsafe_allow_html=True)
+            st.markdown("<div class='bad'>" + L.flow_bad + "</div>", unsafe_allow_html=True)
 
         # Per-vessel table on screen (with rejection %)
         if not per_vessel_df.empty:
-            st.markdown("#### " + _("Stage & Vessel Snapshot"))
+            st.markdown("#### " + L.snapshot)
             st.dataframe(per_vessel_df, use_container_width=True, height=260)
         else:
             st.caption("No per-vessel readings provided.")
@@ -655,6 +1005,9 @@ def _ensure_per_vessel_df(pv_df: pd.DataFrame) -> pd.DataFrame:
     """Return a safe per-vessel dataframe with proper localized column headers."""
     if pv_df is None or pv_df.empty:
         return pd.DataFrame(columns=["Stage", "Vessel", _("Permeate TDS (ppm)"), _("Rejection % (vessel)")])
+    # the save path already builds this frame in stage/vessel order with localized headers: nothing to fix up
+    if list(pv_df.columns) == ["Stage", "Vessel", _("Permeate TDS (ppm)"), _("Rejection % (vessel)")]:
+        return pv_df
     # Standardize column names if user has old CSVs
     rename_map = {}
     for col in pv_df.columns:
@@ -674,10 +1027,11 @@ def _ensure_per_vessel_df(pv_df: pd.DataFrame) -> pd.DataFrame:
         pass
     return pv_df
 
-def _stage_snapshot_table_data(row: dict, pv_df: pd.DataFrame, stage_count: int):
+def _stage_snapshot_table_data(row: dict, pv_df: pd.DataFrame, stage_count: int, lang: str):
     """Build a compact table for PDF with stage avgs + first 12 vessel lines."""
+    L = _tr_table(lang)
     # Stage averages
-    tbl=[[_("Metric"), _("Value"), "", "", "", "", ""]]
+    tbl=[[L.metric, L.value, "", "", "", "", ""]]
     for i in range(1, stage_count+1):
         avg_tds = row.get(f"stage_{i}_avg_tds")
         rej     = row.get(f"stage_{i}_rejection_pct")
@@ -685,202 +1039,231 @@ def _stage_snapshot_table_data(row: dict, pv_df: pd.DataFrame, stage_count: int)
                     f"Stage {i} Rej %", f"{(rej if rej is not None else 0):.1f}", "", "", ""])
     # Per-vessel compact (up to 12)
     tbl.append(["", "", "", "", "", "", ""])
-    tbl.append([_("Vessel"), _("Permeate TDS (ppm)"), _("Rejection % (vessel)"),
-                _("Vessel"), _("Permeate TDS (ppm)"), _("Rejection % (vessel)"), ""])
+    tbl.append([L.vessel, L.perm_tds, L.rej_vessel,
+                L.vessel, L.perm_tds, L.rej_vessel, ""])
     max_print = min(12, len(pv_df))
+    # pull the four columns out once; rows are then plain positional lookups
+    stg = pv_df["Stage"].to_numpy(dtype=np.int32)[:max_print]
+    ves = pv_df["Vessel"].to_numpy(dtype=np.int32)[:max_print]
+    tds = pv_df[L.perm_tds].to_numpy(dtype=np.float64)[:max_print]
+    rej = np.nan_to_num(pv_df[L.rej_vessel].to_numpy(dtype=np.float64)[:max_print])
+    cells = [(f"S{s} V{v}", f"{t:.1f}", f"{r:.1f}") for s, v, t, r in zip(stg.tolist(), ves.tolist(), tds.tolist(), rej.tolist())]
     for i in range(0, max_print, 2):
-        r1 = pv_df.iloc[i]
-        if i+1 < max_print:
-            r2 = pv_df.iloc[i+1]
-            tbl.append([f"S{int(r1['Stage'])} V{int(r1['Vessel'])}",
-                        f"{float(r1[_('Permeate TDS (ppm)')]):.1f}",
-                        f"{float(r1[_('Rejection % (vessel)')] or 0):.1f}",
-                        f"S{int(r2['Stage'])} V{int(r2['Vessel'])}",
-                        f"{float(r2[_('Permeate TDS (ppm)')]):.1f}",
-                        f"{float(r2[_('Rejection % (vessel)')] or 0):.1f}",
-                        ""])
-        else:
-            tbl.append([f"S{int(r1['Stage'])} V{int(r1['Vessel'])}",
-                        f"{float(r1[_('Permeate TDS (ppm)')]):.1f}",
-                        f"{float(r1[_('Rejection % (vessel)')] or 0):.1f}",
-                        "", "", "", ""])
+        right = cells[i+1] if i+1 < max_print else ("", "", "")
+        tbl.append([*cells[i], *right, ""])
     return tbl
 
+# xlsxwriter format specs, added once per workbook
+_XLSX_FMT_SPECS = {
+    "h": {"bold": True, "bg_color": "#F0F4FF", "border": 1},
+    "sub": {"italic": True, "font_color": "#666"},
+    "ok": {"bg_color": "#E8F5E9"},
+    "bad": {"bg_color": "#FFEBEE"},
+    "title": {"bold": True, "font_size": 14},
+    "hdr": {"bold": True, "border": 1, "align": "center", "valign": "top"},  # same look as to_excel headers
+}
+def _make_formats(wb): return {k: wb.add_format(v) for k, v in _XLSX_FMT_SPECS.items()}
+
+def _write_frame(ws, df: pd.DataFrame, hdr):
+    """Header row + one write_column per column (NaN -> blank cell), without to_excel's per-cell formatter."""
+    ws.write_row(0, 0, [str(c) for c in df.columns], hdr)
+    for j, c in enumerate(df.columns if not df.empty else ()):
+        col = df[c]
+        ws.write_column(1, j, col.astype(object).where(col.notna(), None).tolist())
+
+def _add_recent_chart(ws, wb, recent: pd.DataFrame):
+    """Size the Recent_30d columns and add the feed/product TDS line chart."""
+    n = len(recent)
+    ws.set_column(0, 0, 12); ws.set_column(1, len(recent.columns)-1, 16)
+    ch = wb.add_chart({"type":"line"})
+    for name, c in (("Feed TDS", 1), ("Product TDS", 2)):
+        ch.add_series({"name":name, "categories":["Recent_30d",1,0,n,0], "values":["Recent_30d",1,c,n,c]})
+    ch.set_title({"name":("TDS Trend (last 30 days)")}); ch.set_x_axis({"name":("Date (short)")}); ch.set_y_axis({"name":"ppm"})
+    ws.insert_chart("H3", ch, {"x_scale":1.2,"y_scale":1.0})
+
+def _build_xlsx_bytes(row: dict, per_vessel_df: pd.DataFrame, df_all: pd.DataFrame, ctx: dict, out_path: Path) -> bytes:
+    """Daily Excel workbook; the session values it needs come in through ctx."""
+    def _(s): return tr(s, ctx["lang"])
+    def _fmt(key, **kw): return tr_fmt(key, ctx["lang"], **kw)
+    excel_buf = io.BytesIO()
+    with pd.ExcelWriter(excel_buf, engine="xlsxwriter", engine_kwargs=XLSX_ENGINE_KWARGS) as writer:
+        wb = writer.book
+        # styles
+        fmt = _make_formats(wb)
+        h, sub, okfmt, badfmt, title = fmt["h"], fmt["sub"], fmt["ok"], fmt["bad"], fmt["title"]
+
+        # Summary sheet
+        ws = wb.add_worksheet("Summary")
+        breakup, tot_v, tot_m = _design_summary(tuple(ctx["vessels_per_stage"]), int(ctx["membranes_per_vessel"]))
+        ws.write("A1", f"{BRAND} — " + _("Daily Report"), title)
+        ws.write("A2", f"{_('Plant Capacity')}: {int(ctx['plant_capacity'])} m³/d | {row['date']}", sub)
+        ws.write("A3", _fmt("Design: {breakup} • Vessels: {tot_v} • Membranes: {tot_m}", breakup=breakup, tot_v=tot_v, tot_m=tot_m), sub)
+
+        inputs = [
+            [_("Feed TDS (ppm)"), row["feed_tds"]],
+            [_("Product TDS (ppm)"), row["product_tds"]],
+            [_("Feed Pressure IN (bar)"), row["feed_p_in"]],
+            [_("Feed Pressure OUT (bar)"), row["feed_p_out"]],
+            [_("Cartridge Filter Pressure (bar)"), row["cartridge_p"]],
+            [_("HP Pump IN (bar)"), row["hp_in"]],
+            [_("HP Pump OUT (bar)"), row["hp_out"]],
+            [_("Feed Flow (LPM)"), row["feed_flow_lpm"]],
+            [_("Product Flow (LPM)"), row["product_flow_lpm"]],
+            [_("Reject Flow (LPM) (calc)"), row["reject_flow_lpm"]],
+            [_("Water Temperature (°C)"), row["temp_c"]],
+            [_("pH"), row["ph"]],
+            [_("SDI"), row["sdi"]],
+        ]
+        # plain rows with the header format (add_table's object model is overkill for 13 cells)
+        ws.write_row(4, 0, ["Field", "Value"], h)
+        # every input is a float: typed writes skip write()'s per-cell type dispatch
+        for i, (k, v) in enumerate(inputs): ws.write_string(5+i, 0, k); ws.write_number(5+i, 1, v)
+
+        out = [
+            [_("Recovery %"), row["recovery_pct"]],
+            [_("Rejection %"), row.get("rejection_pct") or 0.0],
+            [_("Pressure Recovery %"), row.get("pressure_recovery_pct") or 0.0],
+            [_("Salt Passage (%)"), row["salt_passage_pct"]],
+            [_("ΔP Cartridge (bar)"), row.get("cartridge_dp") or 0.0],
+            [_("ΔP Vessels (bar)"), row.get("vessel_dp") or 0.0],
+            [_("HP ΔP (bar)"), row.get("hp_dp") or 0.0],
+            [_("NDP (bar)"), row["ndp_bar"]],
+            [_("NPF (LPM)"), row["npf_lpm"]],
+            [_("PQI (0–100)"), row.get("pqi") or 0.0],
+            [_("Specific Energy (kWh/m³)"), row["specific_energy_kwh_m3"]],
+            [_("Energy Today (kWh)"), row["daily_kwh"]],
+            [_("Mass Balance Error (%)"), row["mass_balance_err_pct"]],
+            [_("Flow balance OK (Feed ≈ Product + Reject)"), "Yes" if row.get("feed_vs_sum_ok") else "No"],
+        ]
+        ws.write_row(4, 4, ["Metric", "Value"], h)
+        # all KPIs are floats except the closing Yes/No flow-balance row
+        for i, (k, v) in enumerate(out[:-1]): ws.write_string(5+i, 4, k); ws.write_number(5+i, 5, v)
+        ws.write_row(4+len(out), 4, out[-1])
+        ws.set_column(0, 0, 32); ws.set_column(4, 4, 40)
+        ws.write("A20", _("Daily Note"), h); ws.write("A21", row["maintenance_note"])
+        # Conditional YES/NO coloring
+        ws.conditional_format(5,5,4+len(out),5,{"type":"text","criteria":"containing","value":"Yes","format":okfmt})
+        ws.conditional_format(5,5,4+len(out),5,{"type":"text","criteria":"containing","value":"No","format":badfmt})
+
+        # Per-vessel sheet
+        pv_cols = list(per_vessel_df.columns)
+        ws2 = wb.add_worksheet("Per_Vessel")
+        _write_frame(ws2, per_vessel_df, fmt["hdr"])
+        ws2.set_column(0, len(pv_cols)-1, 18)
+        # Conditional format on Rejection% column (localized name); nothing to color without readings
+        rej_col_name = _("Rejection % (vessel)")
+        if rej_col_name in pv_cols and not per_vessel_df.empty:
+            rej_idx = pv_cols.index(rej_col_name)
+            ws2.conditional_format(1, rej_idx, len(per_vessel_df)+1, rej_idx,
+                                   {"type":"cell","criteria":"<","value":60,"format":badfmt})
+
+        # Stage averages sheet
+        stages = np.arange(1, int(ctx["num_stages"])+1)
+        _write_frame(wb.add_worksheet("Stage_Avg"), pd.DataFrame({
+            "Stage": stages,
+            "Avg TDS (ppm)": np.array([row.get(f"stage_{i}_avg_tds") for i in stages], dtype=np.float64),
+            "Stage Rejection (%)": np.array([row.get(f"stage_{i}_rejection_pct") for i in stages], dtype=np.float64),
+        }), fmt["hdr"])
+
+        # 30d trend (opt-in from the daily form)
+        recent = df_all.tail(30).copy() if ctx.get("want_trend") else df_all.iloc[:0]
+        if not recent.empty:
+            recent["date"] = pd.to_datetime(recent["date"])
+            recent = recent[["date","feed_tds","product_tds","recovery_pct","rejection_pct","cartridge_dp","vessel_dp"]]
+            recent.to_excel(writer, index=False, sheet_name="Recent_30d")
+            _add_recent_chart(writer.sheets["Recent_30d"], wb, recent)
+    out_path.write_bytes(excel_buf.getvalue())
+    return excel_buf.getvalue()
+
+def _build_pdf_bytes(row: dict, per_vessel_df: pd.DataFrame, ctx: dict, out_path: Path) -> bytes:
+    """Daily PDF report; same contract as _build_xlsx_bytes."""
+    def _(s): return tr(s, ctx["lang"])
+    def _fmt(key, **kw): return tr_fmt(key, ctx["lang"], **kw)
+    pdf=io.BytesIO()
+    doc=SimpleDocTemplate(pdf, pagesize=A4, leftMargin=24, rightMargin=24, topMargin=28, bottomMargin=28)
+    styles=getSampleStyleSheet(); title_s=styles["Title"]; normal=styles["Normal"]
+    elements=[]
+    breakup, tot_v, tot_m = _design_summary(tuple(ctx["vessels_per_stage"]), int(ctx["membranes_per_vessel"]))
+
+    elements.append(Paragraph(f"<b>{BRAND} — " + _("Daily Report") + "</b>", title_s))
+    elements.append(Paragraph(f"{_('Plant Capacity')}: {int(ctx['plant_capacity'])} m³/day • {row['date']}", normal))
+    elements.append(Paragraph(_fmt("Design: {breakup} • Vessels: {tot_v} • Membranes: {tot_m}", breakup=breakup, tot_v=tot_v, tot_m=tot_m), normal))
+    elements.append(Spacer(1,8))
+
+    inputs_tbl=[[("Field"),("Value")],
+                [("Feed TDS (ppm)"), f"{row['feed_tds']:.0f}"],[("Product TDS (ppm)"), f"{row['product_tds']:.0f}"],
+                [("Feed Pressure IN (bar)"), f"{row['feed_p_in']:.2f}"],[("Feed Pressure OUT (bar)"), f"{row['feed_p_out']:.2f}"],
+                [_("Cartridge Filter Pressure (bar)"), f"{row['cartridge_p']:.2f}"],
+                [("HP Pump IN (bar)"), f"{row['hp_in']:.2f}"],[("HP Pump OUT (bar)"), f"{row['hp_out']:.2f}"],
+                [("Feed Flow (LPM)"), f"{row['feed_flow_lpm']:.1f}"],[("Product Flow (LPM)"), f"{row['product_flow_lpm']:.1f}"],
+                [_("Reject Flow (LPM) (calc)"), f"{row['reject_flow_lpm']:.1f}"],
+                [("Water Temperature (°C)"), f"{row['temp_c']:.1f}"],[("pH"), f"{row['ph']:.1f}"],[_("SDI"), f"{row['sdi']:.1f}"]]
+    # one grid style object shared by every table (the header band only applies to inputs/outputs)
+    grid = [('BOX',(0,0),(-1,-1),0.6,colors.black),('INNERGRID',(0,0),(-1,-1),0.25,colors.grey),('ALIGN',(0,0),(-1,-1),'CENTER')]
+    head_grid = TableStyle([('BACKGROUND',(0,0),(-1,0), colors.HexColor("#EEF4FF")), *grid])
+    t_in=Table(inputs_tbl, colWidths=[180, 120], style=head_grid)
+    elements.append(Paragraph("<b>"+_("Inputs")+"</b>", normal)); elements.append(t_in); elements.append(Spacer(1,8))
+
+    out_tbl=[[("Metric"),("Value"),("Metric"),("Value")],
+             [_("Recovery %"), f"{row['recovery_pct']:.1f}", _("Rejection %"), f"{(row.get('rejection_pct') or 0):.1f}"],
+             [_("Pressure Recovery %"), f"{(row.get('pressure_recovery_pct') or 0):.1f}", _("Salt Passage (%)"), f"{row['salt_passage_pct']:.2f}"],
+             [_("ΔP Cartridge (bar)"), f"{(row.get('cartridge_dp') or 0):.2f}", _("ΔP Vessels (bar)"), f"{(row.get('vessel_dp') or 0):.2f}"],
+             [_("HP ΔP (bar)"), f"{(row.get('hp_dp') or 0):.2f}", _("NDP (bar)"), f"{row['ndp_bar']:.2f}"],
+             [_("NPF (LPM)"), f"{row['npf_lpm']:.1f}", _("Specific Energy (kWh/m³)"), f"{row['specific_energy_kwh_m3']:.2f}"],
+             [_("Energy Today (kWh)"), f"{row['daily_kwh']:.0f}", _("Mass Balance Error (%)"), f"{row['mass_balance_err_pct']:.2f}"]]
+    t_out=Table(out_tbl, colWidths=[150,80,150,80], style=head_grid)
+    elements.append(Paragraph("<b>"+_("Outputs / KPIs")+"</b>", normal)); elements.append(t_out); elements.append(Spacer(1,8))
+
+    # Stage & per-vessel snapshot
+    tbl = _stage_snapshot_table_data(row, per_vessel_df, int(ctx["num_stages"]), ctx["lang"])
+    t_st=Table(tbl, colWidths=[90,80,70,90,80,70,10], style=grid)
+    elements.append(Paragraph("<b>"+_("Stage & Vessel Snapshot")+"</b>", normal)); elements.append(t_st); elements.append(Spacer(1,6))
+
+    elements.append(Paragraph(f"<b>{_('Daily Note')}:</b> {row['maintenance_note']}", normal))
+    doc.build(elements)
+    out_path.write_bytes(pdf.getvalue())
+    return pdf.getvalue()
+
 # ---------- EXCEL & PDF EXPORTS (called right after Calculate & Save in PART 1) ----------
-if st.session_state.get("page_mode") == tr("Daily Report", st.session_state["lang"]) and 'row' in locals():
+if st.session_state.get("page_mode") == tr("Daily Report", lang) and 'row' in locals():
     # Make sure per_vessel_df is safe & localized
     per_vessel_df = _ensure_per_vessel_df(per_vessel_df)
 
+    ctx = {k: st.session_state[k] for k in ("lang", "plant_capacity", "num_stages", "vessels_per_stage", "membranes_per_vessel", "want_trend")}
+    reports_dir = user_reports_dir(st.session_state.user_email, "daily")
+    fn_base = f"daily_{int(ctx['plant_capacity'])}m3d_{int(ctx['num_stages'])}stages_{row['date']}"
+    # re-saving the same day with the same inputs serves the files built last time instead of rebuilding both
+    h = hashlib.blake2b(_json_line(row) + _json_line(ctx), digest_size=16)
+    h.update(pd.util.hash_pandas_object(per_vessel_df, index=False).to_numpy().tobytes())
+    if ctx["want_trend"]: h.update(pd.util.hash_pandas_object(df_all.tail(30), index=False).to_numpy().tobytes())
+    cached = st.session_state.get("daily_export")
+    if cached is None or cached[0] != h.digest():
+        xlsx_bytes = _build_xlsx_bytes(row, per_vessel_df, df_all, ctx, reports_dir/f"{fn_base}.xlsx") if XLSX_OK else None
+        pdf_bytes  = _build_pdf_bytes(row, per_vessel_df, ctx, reports_dir/f"{fn_base}.pdf") if REPORTLAB_OK else None
+        cached = (h.digest(), xlsx_bytes, pdf_bytes)
+        st.session_state["daily_export"] = cached
+    _key, xlsx_bytes, pdf_bytes = cached
+
     # -------- Excel ----------
-    if XLSX_OK:
-        excel_buf = io.BytesIO()
-        with pd.ExcelWriter(excel_buf, engine="xlsxwriter") as writer:
-            wb = writer.book
-            # styles
-            h = wb.add_format({"bold": True, "bg_color": "#F0F4FF", "border": 1})
-            sub = wb.add_format({"italic": True, "font_color": "#666"})
-            okfmt = wb.add_format({"bg_color": "#E8F5E9"})
-            badfmt = wb.add_format({"bg_color": "#FFEBEE"})
-            title = wb.add_format({"bold": True, "font_size": 14})
-
-            # Summary sheet
-            ws = wb.add_worksheet("Summary")
-            breakup = " | ".join([f"S{i+1}:{v}" for i,v in enumerate(st.session_state['vessels_per_stage'])])
-            tot_v = int(sum(st.session_state['vessels_per_stage']))
-            tot_m = int(tot_v*st.session_state['membranes_per_vessel'])
-            ws.write("A1", f"{BRAND} — " + _("Daily Report"), title)
-            ws.write("A2", f"{_('Plant Capacity')}: {int(st.session_state['plant_capacity'])} m³/d | {row['date']}", sub)
-            ws.write("A3", _fmt("Design: {breakup} • Vessels: {tot_v} • Membranes: {tot_m}", breakup=breakup, tot_v=tot_v, tot_m=tot_m), sub)
-
-            inputs = [
-                [_("Feed TDS (ppm)"), row["feed_tds"]],
-                [_("Product TDS (ppm)"), row["product_tds"]],
-                [_("Feed Pressure IN (bar)"), row["feed_p_in"]],
-                [_("Feed Pressure OUT (bar)"), row["feed_p_out"]],
-                [_("Cartridge Filter Pressure (bar)"), row["cartridge_p"]],
-                [_("HP Pump IN (bar)"), row["hp_in"]],
-                [_("HP Pump OUT (bar)"), row["hp_out"]],
-                [_("Feed Flow (LPM)"), row["feed_flow_lpm"]],
-                [_("Product Flow (LPM)"), row["product_flow_lpm"]],
-                [_("Reject Flow (LPM) (calc)"), row["reject_flow_lpm"]],
-                [_("Water Temperature (°C)"), row["temp_c"]],
-                [_("pH"), row["ph"]],
-                [_("SDI"), row["sdi"]],
-            ]
-            ws.add_table(4,0,4+len(inputs),1,
-                         {"data":inputs,"columns":[{"header":("Field")},{"header":("Value")}],
-                          "style":"Table Style Light 9"})
-
-            out = [
-                [_("Recovery %"), row["recovery_pct"]],
-                [_("Rejection %"), row.get("rejection_pct") or 0.0],
-                [_("Pressure Recovery %"), row.get("pressure_recovery_pct") or 0.0],
-                [_("Salt Passage (%)"), row["salt_passage_pct"]],
-                [_("ΔP Cartridge (bar)"), row.get("cartridge_dp") or 0.0],
-                [_("ΔP Vessels (bar)"), row.get("vessel_dp") or 0.0],
-                [_("HP ΔP (bar)"), row.get("hp_dp") or 0.0],
-                [_("NDP (bar)"), row["ndp_bar"]],
-                [_("NPF (LPM)"), row["npf_lpm"]],
-                [_("PQI (0–100)"), row.get("pqi") or 0.0],
-                [_("Specific Energy (kWh/m³)"), row["specific_energy_kwh_m3"]],
-                [_("Energy Today (kWh)"), row["daily_kwh"]],
-                [_("Mass Balance Error (%)"), row["mass_balance_err_pct"]],
-                [_("Flow balance OK (Feed ≈ Product + Reject)"), "Yes" if row.get("feed_vs_sum_ok") else "No"],
-            ]
-            ws.add_table(4,4,4+len(out),5,
-                         {"data":out,"columns":[{"header":("Metric")},{"header":("Value")}],
-                          "style":"Table Style Light 9"})
-            ws.write("A20", _("Daily Note"), h); ws.write("A21", row["maintenance_note"])
-            # Conditional YES/NO coloring
-            ws.conditional_format(5,5,4+len(out),5,{"type":"text","criteria":"containing","value":"Yes","format":okfmt})
-            ws.conditional_format(5,5,4+len(out),5,{"type":"text","criteria":"containing","value":"No","format":badfmt})
-
-            # Per-vessel sheet
-            pv_df = per_vessel_df.copy()
-            pv_df.to_excel(writer, index=False, sheet_name="Per_Vessel")
-            ws2 = writer.sheets["Per_Vessel"]
-            ws2.set_column(0, len(pv_df.columns)-1, 18)
-            # Conditional format on Rejection% column (localized name)
-            rej_col_name = _("Rejection % (vessel)")
-            if rej_col_name in pv_df.columns:
-                rej_idx = list(pv_df.columns).index(rej_col_name)
-                ws2.conditional_format(1, rej_idx, len(pv_df)+1, rej_idx,
-                                       {"type":"cell","criteria":"<","value":60,"format":badfmt})
-
-            # Stage averages sheet
-            stage_rows=[]
-            for i in range(1, st.session_state["num_stages"]+1):
-                stage_rows.append({
-                    "Stage": i,
-                    "Avg TDS (ppm)": row.get(f"stage_{i}_avg_tds"),
-                    "Stage Rejection (%)": row.get(f"stage_{i}_rejection_pct"),
-                })
-            pd.DataFrame(stage_rows).to_excel(writer, index=False, sheet_name="Stage_Avg")
-
-            # 30d trend
-            recent = df_all.tail(30).copy()
-            if not recent.empty:
-                recent["date"] = pd.to_datetime(recent["date"])
-                recent = recent[["date","feed_tds","product_tds","recovery_pct","rejection_pct","cartridge_dp","vessel_dp"]]
-                recent.to_excel(writer, index=False, sheet_name="Recent_30d")
-                ws3 = writer.sheets["Recent_30d"]
-                ws3.set_column(0, 0, 12); ws3.set_column(1, len(recent.columns)-1, 16)
-                ch = wb.add_chart({"type":"line"})
-                ch.add_series({"name":"Feed TDS","categories":["Recent_30d",1,0,len(recent),0],
-                               "values":["Recent_30d",1,1,len(recent),1]})
-                ch.add_series({"name":"Product TDS","categories":["Recent_30d",1,0,len(recent),0],
-                               "values":["Recent_30d",1,2,len(recent),2]})
-                ch.set_title({"name":("TDS Trend (last 30 days)")}); ch.set_x_axis({"name":("Date (short)")}); ch.set_y_axis({"name":"ppm"})
-                ws3.insert_chart("H3", ch, {"x_scale":1.2,"y_scale":1.0})
-
-        fn_x=f"daily_{int(st.session_state['plant_capacity'])}m3d_{int(st.session_state['num_stages'])}stages_{row['date']}.xlsx"
-        st.download_button(_("Download Daily Excel"), excel_buf.getvalue(), file_name=fn_x,
+    if xlsx_bytes is not None:
+        st.download_button(_("Download Daily Excel"), xlsx_bytes, file_name=f"{fn_base}.xlsx",
                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-        (user_reports_dir(st.session_state.user_email,"daily")/fn_x).write_bytes(excel_buf.getvalue())
 
     # -------- PDF ----------
-    if REPORTLAB_OK:
-        pdf=io.BytesIO()
-        doc=SimpleDocTemplate(pdf, pagesize=A4, leftMargin=24, rightMargin=24, topMargin=28, bottomMargin=28)
-        styles=getSampleStyleSheet(); title_s=styles["Title"]; normal=styles["Normal"]
-        elements=[]
-        breakup=" | ".join([f"S{i+1}:{v}" for i,v in enumerate(st.session_state['vessels_per_stage'])])
-        tot_v = int(sum(st.session_state['vessels_per_stage'])); tot_m = int(tot_v*st.session_state['membranes_per_vessel'])
-
-        elements.append(Paragraph(f"<b>{BRAND} — " + _("Daily Report") + "</b>", title_s))
-        elements.append(Paragraph(f"{_('Plant Capacity')}: {int(st.session_state['plant_capacity'])} m³/day • {row['date']}", normal))
-        elements.append(Paragraph(_fmt("Design: {breakup} • Vessels: {tot_v} • Membranes: {tot_m}", breakup=breakup, tot_v=tot_v, tot_m=tot_m), normal))
-        elements.append(Spacer(1,8))
-
-        inputs_tbl=[[("Field"),("Value")],
-                    [("Feed TDS (ppm)"), f"{row['feed_tds']:.0f}"],[("Product TDS (ppm)"), f"{row['product_tds']:.0f}"],
-                    [("Feed Pressure IN (bar)"), f"{row['feed_p_in']:.2f}"],[("Feed Pressure OUT (bar)"), f"{row['feed_p_out']:.2f}"],
-                    [_("Cartridge Filter Pressure (bar)"), f"{row['cartridge_p']:.2f}"],
-                    [("HP Pump IN (bar)"), f"{row['hp_in']:.2f}"],[("HP Pump OUT (bar)"), f"{row['hp_out']:.2f}"],
-                    [("Feed Flow (LPM)"), f"{row['feed_flow_lpm']:.1f}"],[("Product Flow (LPM)"), f"{row['product_flow_lpm']:.1f}"],
-                    [_("Reject Flow (LPM) (calc)"), f"{row['reject_flow_lpm']:.1f}"],
-                    [("Water Temperature (°C)"), f"{row['temp_c']:.1f}"],[("pH"), f"{row['ph']:.1f}"],[_("SDI"), f"{row['sdi']:.1f}"]]
-        t_in=Table(inputs_tbl, colWidths=[180, 120])
-        t_in.setStyle(TableStyle([('BACKGROUND',(0,0),(-1,0), colors.HexColor("#EEF4FF")),
-                                  ('BOX',(0,0),(-1,-1),0.6,colors.black),('INNERGRID',(0,0),(-1,-1),0.25,colors.grey),
-                                  ('ALIGN',(0,0),(-1,-1),'CENTER')]))
-        elements.append(Paragraph("<b>"+_("Inputs")+"</b>", normal)); elements.append(t_in); elements.append(Spacer(1,8))
-
-        out_tbl=[[("Metric"),("Value"),("Metric"),("Value")],
-                 [_("Recovery %"), f"{row['recovery_pct']:.1f}", _("Rejection %"), f"{(row.get('rejection_pct') or 0):.1f}"],
-                 [_("Pressure Recovery %"), f"{(row.get('pressure_recovery_pct') or 0):.1f}", _("Salt Passage (%)"), f"{row['salt_passage_pct']:.2f}"],
-                 [_("ΔP Cartridge (bar)"), f"{(row.get('cartridge_dp') or 0):.2f}", _("ΔP Vessels (bar)"), f"{(row.get('vessel_dp') or 0):.2f}"],
-                 [_("HP ΔP (bar)"), f"{(row.get('hp_dp') or 0):.2f}", _("NDP (bar)"), f"{row['ndp_bar']:.2f}"],
-                 [_("NPF (LPM)"), f"{row['npf_lpm']:.1f}", _("Specific Energy (kWh/m³)"), f"{row['specific_energy_kwh_m3']:.2f}"],
-                 [_("Energy Today (kWh)"), f"{row['daily_kwh']:.0f}", _("Mass Balance Error (%)"), f"{row['mass_balance_err_pct']:.2f}"]]
-        t_out=Table(out_tbl, colWidths=[150,80,150,80])
-        t_out.setStyle(TableStyle([('BACKGROUND',(0,0),(-1,0), colors.HexColor("#EEF4FF")),
-                                   ('BOX',(0,0),(-1,-1),0.6,colors.black),('INNERGRID',(0,0),(-1,-1),0.25,colors.grey),
-                                   ('ALIGN',(0,0),(-1,-1),'CENTER')]))
-        elements.append(Paragraph("<b>"+_("Outputs / KPIs")+"</b>", normal)); elements.append(t_out); elements.append(Spacer(1,8))
-
-        # Stage & per-vessel snapshot
-        pv_df = _ensure_per_vessel_df(per_vessel_df)
-        tbl = _stage_snapshot_table_data(row, pv_df, int(st.session_state["num_stages"]))
-        t_st=Table(tbl, colWidths=[90,80,70,90,80,70,10])
-        t_st.setStyle(TableStyle([('BOX',(0,0),(-1,-1),0.6,colors.black),('INNERGRID',(0,0),(-1,-1),0.25,colors.grey),('ALIGN',(0,0),(-1,-1),'CENTER')]))
-        elements.append(Paragraph("<b>"+_("Stage & Vessel Snapshot")+"</b>", normal)); elements.append(t_st); elements.append(Spacer(1,6))
-
-        elements.append(Paragraph(f"<b>{_('Daily Note')}:</b> {row['maintenance_note']}", normal))
-        doc.build(elements)
-        fn_p=f"daily_{int(st.session_state['plant_capacity'])}m3d_{int(st.session_state['num_stages'])}stages_{row['date']}.pdf"
-        st.download_button(_("Download Daily PDF"), pdf.getvalue(), file_name=fn_p, mime="application/pdf")
-        (user_reports_dir(st.session_state.user_email,"daily")/fn_p).write_bytes(pdf.getvalue())
+    if pdf_bytes is not None:
+        st.download_button(_("Download Daily PDF"), pdf_bytes, file_name=f"{fn_base}.pdf", mime="application/pdf")
+    # the optional exporters are imported once at the top; say which one is missing instead of silently omitting it
+    for ok, pkg in ((XLSX_OK, "xlsxwriter"), (REPORTLAB_OK, "reportlab")):
+        if not ok: st.caption(f"{pkg} is not installed: that export is unavailable (pip install {pkg}).")
 
 # ---------- FORECAST UTILS ----------
 def linear_forecast_next(values: list, horizon_days: int = 30):
     if len(values)<2: return [values[-1]]*horizon_days if values else [0.0]*horizon_days
-    x=np.arange(len(values)); y=np.array(values, float)
-    try:
-        m,b=np.polyfit(x,y,1); xf=np.arange(len(values), len(values)+horizon_days)
-        return (m*xf+b).tolist()
-    except Exception:
-        return [values[-1]]*horizon_days
+    # closed-form degree-1 least squares (polyfit's Vandermonde + SVD is overkill here)
+    n=len(values); y=np.asarray(values, float); x=np.arange(n, dtype=float)
+    dx=x-x.mean(); ym=y.mean()
+    m=(dx*(y-ym)).sum()/max((dx*dx).sum(), 1e-12); b=ym-m*x.mean()
+    return (m*np.arange(n, n+horizon_days, dtype=float)+b).tolist()
 
 def next_crossing_day(series_future, threshold, above=True):
     for i,v in enumerate(series_future):
@@ -888,37 +1271,39 @@ def next_crossing_day(series_future, threshold, above=True):
     return None
 
 # ---------- WEEKLY ----------
-if st.session_state["page_mode"] == tr("Weekly Report", st.session_state["lang"]):
+if st.session_state["page_mode"] == tr("Weekly Report", lang):
     st.markdown("### 📅 " + _("Weekly Report"))
     start_date = st.date_input(_("Date"), value=date.today()-timedelta(days=6))
-    path = csv_path_for_current()
-    if not path.exists():
+    shards = history_shards(daily_path_for_current(), {start_date.year, (start_date+timedelta(days=6)).year})
+    if not shards:
         st.warning(_("No data yet."))
     else:
-        df=pd.read_csv(path); df["date"]=pd.to_datetime(df["date"]).dt.date
-        df_week = df[(df["date"]>=start_date) & (df["date"]<=start_date+timedelta(days=6))].sort_values("date")
+        df=load_history(shards)
+        start_ts = pd.Timestamp(start_date); end_ts = start_ts + pd.Timedelta(days=6)
+        df_week = _date_slice(df, start_ts, end_ts)
         if df_week.empty:
             st.warning(_("No data yet."))
         else:
             try:
                 last_conf = df_week.dropna(subset=["vessels_per_stage"]).iloc[-1]
                 vps=json.loads(last_conf["vessels_per_stage"]); mpv=int(last_conf.get("membranes_per_vessel",6))
-                tot_v=int(sum(vps)); tot_m=int(tot_v*mpv); brk=" | ".join([f"S{i+1}:{v}" for i,v in enumerate(vps)])
+                brk, tot_v, tot_m = _design_summary(tuple(vps), mpv)
                 st.info(_fmt("Design: {breakup} • Vessels: {tot_v} • Membranes: {tot_m}", breakup=brk, tot_v=tot_v, tot_m=tot_m))
             except Exception:
                 pass
             st.dataframe(df_week, use_container_width=True)
-            def avg(col): return float(df_week[col].dropna().astype(float).mean()) if col in df_week else None
+            # all six weekly means in one reduction (missing/empty columns read as 0)
+            avg = df_week.reindex(columns=["feed_tds","product_tds","recovery_pct","rejection_pct","cartridge_dp","vessel_dp"]).astype(float).mean().fillna(0.0)
             c1,c2,c3,c4,c5,c6=st.columns(6)
-            c1.metric(_("Avg Feed TDS"), f"{(avg('feed_tds') or 0):.0f} ppm")
-            c2.metric(_("Avg Product TDS"), f"{(avg('product_tds') or 0):.0f} ppm")
-            c3.metric(_("Avg Recovery"), f"{(avg('recovery_pct') or 0):.1f} %")
-            c4.metric(_("Avg Rejection"), f"{(avg('rejection_pct') or 0):.1f} %")
-            c5.metric(_("Avg ΔP Cartridge"), f"{(avg('cartridge_dp') or 0):.2f} bar")
-            c6.metric(_("Avg ΔP Vessels"), f"{(avg('vessel_dp') or 0):.2f} bar")
-
-            # Quick predictions
-            df_for=df_week.copy()
+            c1.metric(_("Avg Feed TDS"), f"{avg['feed_tds']:.0f} ppm")
+            c2.metric(_("Avg Product TDS"), f"{avg['product_tds']:.0f} ppm")
+            c3.metric(_("Avg Recovery"), f"{avg['recovery_pct']:.1f} %")
+            c4.metric(_("Avg Rejection"), f"{avg['rejection_pct']:.1f} %")
+            c5.metric(_("Avg ΔP Cartridge"), f"{avg['cartridge_dp']:.2f} bar")
+            c6.metric(_("Avg ΔP Vessels"), f"{avg['vessel_dp']:.2f} bar")
+
+            # Quick predictions (read-only, so straight off the week slice)
+            df_for=df_week
             checks = [
                 ("product_tds", _("Product TDS (ppm)"), DEFAULT_LIMITS["product_tds_max"], True),
                 ("cartridge_dp", _("ΔP Cartridge (bar)"), DEFAULT_LIMITS["cartridge_dp_max"], True),
@@ -934,69 +1319,67 @@ if st.session_state["page_mode"] == tr("Weekly Report", st.session_state["lang"]
                         st.warning(f"{label}: may cross {thr} in ~{cross} days → due: {due}")
 
 # ---------- MONTHLY ----------
-if st.session_state["page_mode"] == tr("Monthly Report", st.session_state["lang"]):
+if st.session_state["page_mode"] == tr("Monthly Report", lang):
     st.markdown("### 📅 " + _("Monthly Report"))
     month_input = st.date_input(_("Date"), value=date.today())
-    month_str = f"{month_input.year}-{str(month_input.month).zfill(2)}"
-    path = csv_path_for_current()
-    if not path.exists():
+    shards = history_shards(daily_path_for_current(), {month_input.year})
+    if not shards:
         st.warning(_("No data yet."))
     else:
-        df=pd.read_csv(path); df["date"]=pd.to_datetime(df["date"]).dt.date
-        df_month = df[(df["date"].apply(lambda d: d.strftime("%Y-%m"))==month_str)].sort_values("date")
+        df=load_history(shards)
+        m0 = pd.Timestamp(month_input.replace(day=1)); m1 = m0 + pd.offsets.MonthBegin(1)
+        df_month = _date_slice(df, m0, m1, inclusive_hi=False)
         if df_month.empty:
             st.warning(_("No data yet."))
         else:
             try:
                 last_conf=df_month.dropna(subset=["vessels_per_stage"]).iloc[-1]
                 vps=json.loads(last_conf["vessels_per_stage"]); mpv=int(last_conf.get("membranes_per_vessel",6))
-                tot_v=int(sum(vps)); tot_m=int(tot_v*mpv); brk=" | ".join([f"S{i+1}:{v}" for i,v in enumerate(vps)])
+                brk, tot_v, tot_m = _design_summary(tuple(vps), mpv)
                 st.info(_fmt("Design: {breakup} • Vessels: {tot_v} • Membranes: {tot_m}", breakup=brk, tot_v=tot_v, tot_m=tot_m))
             except Exception:
                 pass
             st.dataframe(df_month, use_container_width=True)
             # Monthly energy total
-            monthly_kwh = float(df_month.get('daily_kwh', pd.Series([]))).sum()
-            st.caption(f"{_('Energy Today (kWh)') if 'Energy Today (kWh)' in T['English'] else 'Monthly energy'} ≈ {monthly_kwh:.0f} kWh")
-            # Simple health score
-            score=100
-            if "product_tds" in df_month: score -= min(15, 3*len(df_month[df_month["product_tds"]>DEFAULT_LIMITS["product_tds_max"]]))
-            if "rejection_pct" in df_month: score -= min(15, 2*len(df_month[df_month["rejection_pct"]<DEFAULT_LIMITS["rejection_min"]]))
-            score=max(0,min(100,score))
+            monthly_kwh = float(df_month["daily_kwh"].sum()) if "daily_kwh" in df_month else 0.0
+            st.caption(f"{_('Energy Today (kWh)')} ≈ {monthly_kwh:.0f} kWh")
+            # Simple health score (counts straight from the boolean masks)
+            tds_over  = int((df_month["product_tds"]>DEFAULT_LIMITS["product_tds_max"]).sum()) if "product_tds" in df_month else 0
+            rej_under = int((df_month["rejection_pct"]<DEFAULT_LIMITS["rejection_min"]).sum()) if "rejection_pct" in df_month else 0
+            score = max(0, min(100, 100 - min(15, 3*tds_over) - min(15, 2*rej_under)))
             st.metric(_("Health Score"), f"{score}/100")
 
 # ---------- HISTORY & EXPORTS ----------
-if st.session_state["page_mode"] == tr("History & Exports", st.session_state["lang"]):
+if st.session_state["page_mode"] == tr("History & Exports", lang):
     st.markdown("### 📚 " + _("History & Exports"))
-    path = csv_path_for_current()
-    if not path.exists():
+    shards = history_shards(daily_path_for_current())
+    if not shards:
         st.info(_("No data yet."))
     else:
-        df = pd.read_csv(path); df["date"]=pd.to_datetime(df["date"]).dt.date
+        df = load_history(shards)
         c1,c2,c3 = st.columns(3)
-        date_from = c1.date_input(_("Date") + " (from)", value=df["date"].min())
-        date_to   = c2.date_input(_("Date") + " (to)",   value=df["date"].max())
+        date_from = c1.date_input(_("Date") + " (from)", value=df["date"].min().date())
+        date_to   = c2.date_input(_("Date") + " (to)",   value=df["date"].max().date())
         tds_thr   = c3.number_input(_("Product TDS (ppm)") + " >", 0.0, 1e6, 0.0, 1.0)
-        mask = (df["date"]>=date_from) & (df["date"]<=date_to)
-        if tds_thr>0: mask &= (df["product_tds"]>tds_thr)
-        out = df[mask].sort_values("date")
+        out = _date_slice(df, pd.Timestamp(date_from), pd.Timestamp(date_to))
+        if tds_thr>0: out = out[out["product_tds"].to_numpy() > tds_thr]
         st.dataframe(out, use_container_width=True); st.caption(f"{len(out)} rows")
         if XLSX_OK and not out.empty:
             excel_buf=io.BytesIO()
-            with pd.ExcelWriter(excel_buf, engine="xlsxwriter") as writer:
+            with pd.ExcelWriter(excel_buf, engine="xlsxwriter", engine_kwargs=XLSX_ENGINE_KWARGS) as writer:
                 out.to_excel(writer, index=False, sheet_name="Filtered")
             st.download_button(_("Download Daily Excel"), excel_buf.getvalue(),
                                file_name=f"history_{date_from}to{date_to}.xlsx",
                                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
 # ---------- RO DESIGN (Quick Sizing) ----------
-if st.session_state["page_mode"] == tr("RO Design", st.session_state["lang"]):
+if st.session_state["page_mode"] == tr("RO Design", lang):
     st.markdown("### 🧮 " + _("RO Design — Quick Sizing"))
     cap_m3d = st.number_input(_("Plant Capacity") + " (m³/day)", 10, 50000, int(st.session_state["plant_capacity"]), 10)
     recovery_target = st.slider(_("Design Recovery %"), 40, 85, int(st.session_state["design_rec"]))
     prod_m3h = cap_m3d/24.0; per_elem_m3h = 1.2
     need_elements = int(np.ceil(prod_m3h / per_elem_m3h))
-    per_vessel_elems = st.number_input(tr('Membranes per vessel (8")', st.session_state["lang"]), 1, 8, int(st.session_state["membranes_per_vessel"]), 1)
+    per_vessel_elems = st.number_input(tr('Membranes per vessel (8")', lang), 1, 8, int(st.session_state["membranes_per_vessel"]), 1)
     need_vessels = int(np.ceil(need_elements / per_vessel_elems))
     stages = st.slider(_("Number of Stages"), 1, 6, int(st.session_state["num_stages"]))
     split=[]; rem=need_vessels
@@ -1,7 +1,8 @@
 # db.py  — free-hosting friendly (Postgres if DB_URL set, else SQLite file)
-import os
-from sqlalchemy import create_engine, text
-from sqlalchemy.pool import QueuePool
+import os, threading
+from contextlib import nullcontext
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import QueuePool, StaticPool
 
 DB_URL = os.environ.get("DB_URL")
 
@@ -16,20 +17,35 @@ else:
     DB_URL = "sqlite:///ro.db"
     engine = create_engine(
         DB_URL,
-        connect_args={"check_same_thread": False}  # needed for SQLite in web apps
+        connect_args={"check_same_thread": False},  # needed for SQLite in web apps
+        poolclass=StaticPool,  # one long-lived connection: no reopen per query, page cache stays warm
+        pool_reset_on_return=None,  # engine.begin() always ends its own transaction; skip the extra ROLLBACK per checkin
     )
 
-def fetchone(q, p=()):
-    with engine.connect() as c:
-        return c.execute(text(q), p).mappings().first()
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_con, _rec):
+        # WAL lets readers run alongside the writer; NORMAL skips the per-commit fsync that FULL pays
+        cur = dbapi_con.cursor()
+        for pragma in ("journal_mode=WAL", "synchronous=NORMAL", "mmap_size=268435456",
+                       "temp_store=MEMORY", "cache_size=-20000", "busy_timeout=5000"):
+            cur.execute(f"PRAGMA {pragma}")
+        cur.close()
 
-def fetchall(q, p=()):
-    with engine.connect() as c:
-        return list(c.execute(text(q), p).mappings().all())
+# the shared SQLite connection is used by every session thread, so calls take turns on it
+_lock = threading.RLock() if engine.dialect.name == "sqlite" else nullcontext()
 
-def execute(q, p=()):
-    with engine.begin() as c:
-        c.execute(text(q), p)
+def query(q, p=(), *, one=False, many=None):
+    # single entry point: rows come back as mappings; many=[{...}, ...] runs one executemany batch
+    if many is not None and not many: return None  # an empty batch would otherwise run once with no params
+    with _lock, engine.begin() as c:
+        r = c.execute(text(q), many if many is not None else p)
+        if many is not None or not r.returns_rows: return None
+        m = r.mappings()
+        return m.first() if one else list(m.all())
+
+def fetchone(q, p=()): return query(q, p, one=True)
+def fetchall(q, p=()): return query(q, p)
+def execute(q, p=()): query(q, p)
 
 def migrate():
     # Works for both Postgres and SQLite (SQLite is lenient with types)
@@ -63,8 +79,13 @@ def migrate():
             reject_tds REAL, cf REAL, mb_error REAL,
             dP REAL, pi_feed REAL, pi_perm REAL, d_pi REAL, ndp REAL,
             prod_m3d REAL
-        )"""
+        )""",
+        # hot lookups: a user's runs by capacity, a user's requests by status (users.email is UNIQUE already)
+        "CREATE INDEX IF NOT EXISTS idx_runs_user_cap ON runs(user_id, capacity)",
+        "CREATE INDEX IF NOT EXISTS idx_capreq_user_status ON capacity_requests(user_id, status)",
+        "CREATE INDEX IF NOT EXISTS idx_capreq_status_created ON capacity_requests(status, created_at DESC)",
     ]
-    with engine.begin() as c:
+    with _lock, engine.begin() as c:
         for s in stmts:
-            c.execute(text(s))
\ No newline at end of file
+            c.execute(text(s))
+        if engine.dialect.name == "sqlite": c.execute(text("PRAGMA optimize"))
\ No newline at end of file
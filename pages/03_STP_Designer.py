@@ -97,29 +97,36 @@ with col5:
     clar_olr = st.slider(L["Clarifier surface OLR (m³/m²·d)"], 10, 30, 18, 1)
 
 # ---------- Sizing ----------
-V_aer_m3, HRT_h, BOD_kgd = aeration_tank_size(cap_m3d, influent_BOD, SRT, MLSS, FM)
-kgO2_h = air_req_kgO2_per_h(BOD_kgd, aeration_alpha=alpha, OTR_kgO2_per_kWh=OTR)
-blower_kW = kgO2_h / max(OTR,0.5)
-
-clar_area_m2 = secondary_clarifier_area(cap_m3d, overflow_rate_m3_m2_d=clar_olr)
-sludge_kgd   = sludge_production_kgd(BOD_kgd, Y_obs=0.6)
-
-# Effluent polishing suggestions
-tertiary = []
-if eff_target in ("Tertiary (N,P)", "Recycling+UF"): tertiary.append("Tertiary filter/UF")
-if eff_target in ("Tertiary (N,P)",): tertiary.append("Chemical P-removal (Alum/Ferric)")
-tertiary.append("UV/Chlorination")
-
-# BOM
-bom = []
-bom.append(["Aeration Tank", f"{V_aer_m3:,.0f} m³", f"HRT ≈ {HRT_h:.1f} h, MLSS={MLSS} mg/L"])
-bom.append(["Blowers (total)", f"{blower_kW:.1f} kW", f"O₂ demand ≈ {kgO2_h:.1f} kg/h"])
-bom.append(["Secondary Clarifiers", f"{clar_area_m2:,.0f} m² (total surface)", f"OLR={clar_olr} m³/m²·d"])
-bom.append(["Sludge Handling", f"{sludge_kgd:,.0f} kg/d", "Thickener/Filter press"])
-for t in tertiary:
-    bom.append(["Tertiary & Disinfection", t, ""])
-
-bom_df = pd.DataFrame(bom, columns=["Item","Spec","Note"])
+@st.cache_data(max_entries=128, show_spinner=False)
+def compute_stp(cap_m3d, influent_BOD, eff_target, MLSS, SRT, FM, alpha, OTR, clar_olr):
+    # pure sizing: same inputs → memoized result, so unrelated reruns skip all of this
+    V_aer_m3, HRT_h, BOD_kgd = aeration_tank_size(cap_m3d, influent_BOD, SRT, MLSS, FM)
+    kgO2_h = air_req_kgO2_per_h(BOD_kgd, aeration_alpha=alpha, OTR_kgO2_per_kWh=OTR)
+    blower_kW = kgO2_h / max(OTR,0.5)
+
+    clar_area_m2 = secondary_clarifier_area(cap_m3d, overflow_rate_m3_m2_d=clar_olr)
+    sludge_kgd   = sludge_production_kgd(BOD_kgd, Y_obs=0.6)
+
+    # Effluent polishing suggestions
+    tertiary = []
+    if eff_target in ("Tertiary (N,P)", "Recycling+UF"): tertiary.append("Tertiary filter/UF")
+    if eff_target in ("Tertiary (N,P)",): tertiary.append("Chemical P-removal (Alum/Ferric)")
+    tertiary.append("UV/Chlorination")
+
+    # BOM
+    bom = []
+    bom.append(["Aeration Tank", f"{V_aer_m3:,.0f} m³", f"HRT ≈ {HRT_h:.1f} h, MLSS={MLSS} mg/L"])
+    bom.append(["Blowers (total)", f"{blower_kW:.1f} kW", f"O₂ demand ≈ {kgO2_h:.1f} kg/h"])
+    bom.append(["Secondary Clarifiers", f"{clar_area_m2:,.0f} m² (total surface)", f"OLR={clar_olr} m³/m²·d"])
+    bom.append(["Sludge Handling", f"{sludge_kgd:,.0f} kg/d", "Thickener/Filter press"])
+    for t in tertiary:
+        bom.append(["Tertiary & Disinfection", t, ""])
+
+    bom_df = pd.DataFrame(bom, columns=["Item","Spec","Note"])
+    return V_aer_m3, HRT_h, BOD_kgd, kgO2_h, blower_kW, clar_area_m2, sludge_kgd, bom_df
+
+V_aer_m3, HRT_h, BOD_kgd, kgO2_h, blower_kW, clar_area_m2, sludge_kgd, bom_df = compute_stp(
+    cap_m3d, influent_BOD, eff_target, MLSS, SRT, FM, alpha, OTR, clar_olr)
 
 # ---------- Output ----------
 st.markdown("### Design Summary")
@@ -154,5 +161,5 @@ exp = {
   "bom": bom_df.to_dict(orient="records")
 }
 st.download_button("Download STP Design (JSON)", data=json.dumps(exp, indent=2).encode(), file_name="STP_design.json", mime="application/json")
-csv_buf = io.StringIO(); bom_df.to_csv(csv_buf, index=False)
+csv_buf = io.BytesIO(); bom_df.to_csv(csv_buf, index=False, encoding="utf-8")  # bytes straight out, no str copy to encode
 st.download_button("Download BOM (CSV)", data=csv_buf.getvalue(), file_name="STP_BOM.csv", mime="text/csv")
\ No newline at end of file